@@ -0,0 +1,383 @@
+################################################################################
+#region IMPORTS
+################################################################################
+from config import *
+from crosswalk import load_crosswalk
+from main import accumulate_lines, accumulate_rows, annualize_years, annualize_years_numpy
+from main import fetch_api_totals, finalize_totals, prefilter_lines
+from svg import render_svg
+from concurrent.futures import ProcessPoolExecutor
+import csv, http.server, json, os, random, requests, sys, tempfile, threading, time
+import main as pipeline
+import store
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region CONSTANTS
+################################################################################
+SINGLEFILE_FIELDS = [
+    "area_fips",
+    "own_code",
+    "industry_code",
+    "agglvl_code",
+    "size_code",
+    "year",
+    "qtr",
+    "disclosure_code",
+    "qtrly_estabs",
+    "month1_emplvl",
+    "month2_emplvl",
+    "month3_emplvl",
+    "total_qtrly_wages",
+    "taxable_qtrly_wages",
+    "qtrly_contributions",
+    "avg_wkly_wage",
+]
+SYNTHETIC_YEARS = ["2020", "2021"]
+SYNTHETIC_DETAIL_ROWS = 20 # Ownership/industry rows written for every county and state.
+API_LATENCY = 0.5 # Seconds added to every response by the stand-in QCEW API.
+ANNUAL_YEARS = [str(year) for year in range(1975, 2025)] # Years of synthetic quarterly data to annualize.
+STORE_HISTORY = [50, 2000] # Years of synthetic quarterly data for the store benchmark.
+CHART_COPIES = 3 # Times the README chart set is queued for the chart export benchmark.
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region FUNCTIONS
+################################################################################
+#region main FUNCTION -------------------------------------------------------- #
+def main() -> None:
+    '''
+    Runs the benchmarks named on the command line, or all of them.
+    '''
+    names = sys.argv[1:] or list(BENCHMARKS.keys())
+    for name in names:
+        print(f"# {name}")
+        BENCHMARKS[name]()
+#endregion ------------------------------------------------------------------- #
+#region write_synthetic_singlefile FUNCTION ---------------------------------- #
+def write_synthetic_singlefile(path: str, years: list[str] = SYNTHETIC_YEARS,
+                               detail_rows: int = SYNTHETIC_DETAIL_ROWS) -> int:
+    '''
+    Writes a synthetic QCEW quarterly singlefile with a state total (agglvl 50)
+    and a county total (agglvl 70) for every crosswalk state and county, a 99x
+    county for every state, and `detail_rows` ownership and industry rows
+    beneath each of them. Returns the number of data rows written.
+    '''
+    rng = random.Random(0)
+    states = sorted(set(cnty[0:2] for cnty in CNTY_FRD_CROSSWALK.keys()))
+    n_rows = 0
+    with open(path, "w") as output:
+        csv_writer = csv.writer(output, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+        csv_writer.writerow(SINGLEFILE_FIELDS)
+        for year in years:
+            for qtr in ("1", "2", "3", "4"):
+                areas = [(f"{state}000", "5") for state in states]
+                areas += [(f"{state}999", "7") for state in states]
+                areas += [(cnty, "7") for cnty in CNTY_FRD_CROSSWALK.keys()]
+                for area_fips, level in areas:
+                    for i in range(detail_rows + 1):
+                        agglvl_code = f"{level}{(i - 1) % 8 + 1}" if i > 0 else f"{level}0"
+                        emplvl = [rng.randint(0, 50000) for m in range(3)]
+                        wages = sum(emplvl)*rng.randint(1000, 3000)
+                        csv_writer.writerow([
+                            area_fips, str(i % 6), str(10 + i), agglvl_code, "0",
+                            year, qtr, "" if rng.random() > 0.05 else "N",
+                            rng.randint(0, 5000), *emplvl, wages, wages//2,
+                            wages//100, rng.randint(500, 3000),
+                        ])
+                        n_rows += 1
+    return(n_rows)
+#endregion ------------------------------------------------------------------- #
+#region benchmark_prefilter FUNCTION ----------------------------------------- #
+def benchmark_prefilter() -> None:
+    '''
+    Compares ingestion throughput (rows/sec over all rows in the file) of a
+    synthetic singlefile with and without `prefilter_lines`.
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = f"{tmp_dir}/singlefile.csv"
+        n_rows = write_synthetic_singlefile(path)
+        size_mb = os.path.getsize(path)/1e6
+        print(f"synthetic singlefile: {n_rows:,} rows, {size_mb:.1f} MB")
+
+        results = {}
+        for label, prefilter in (("before", False), ("after", True)):
+            start = time.perf_counter()
+            with open(path, "r") as input:
+                lines = prefilter_lines(input) if prefilter else input
+                results[label] = accumulate_rows(csv.DictReader(lines))
+            seconds = time.perf_counter() - start
+            print(f"{label:>8}: {seconds:6.2f} s, {n_rows/seconds:12,.0f} rows/sec")
+
+        assert results["before"] == results["after"]
+#endregion ------------------------------------------------------------------- #
+#region benchmark_engines FUNCTION ------------------------------------------- #
+def benchmark_engines() -> None:
+    '''
+    Times the "dict" and "numpy" aggregation engines on a synthetic singlefile
+    and checks that they produce identical JSON.
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = f"{tmp_dir}/singlefile.csv"
+        n_rows = write_synthetic_singlefile(path)
+        print(f"synthetic singlefile: {n_rows:,} rows")
+
+        results = {}
+        for engine in ("dict", "numpy"):
+            pipeline.AGGREGATION_ENGINE = engine
+            start = time.perf_counter()
+            with open(path, "r") as input:
+                data = finalize_totals(accumulate_lines(prefilter_lines(input)))
+            seconds = time.perf_counter() - start
+            results[engine] = json.dumps(data, indent=4)
+            print(f"{engine:>8}: {seconds:6.2f} s")
+        pipeline.AGGREGATION_ENGINE = AGGREGATION_ENGINE
+
+        assert results["dict"] == results["numpy"]
+        print("identical JSON output")
+#endregion ------------------------------------------------------------------- #
+#region benchmark_api FUNCTION ----------------------------------------------- #
+def benchmark_api() -> None:
+    '''
+    Compares fetching eight QCEW API slices one after another (as 
+    `update_qtrly_json` used to) with `fetch_api_totals`, against a local 
+    stand-in for the QCEW API that adds `API_LATENCY` seconds to every response.
+    Half of the slices return 404, as future quarters do.
+    '''
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = f"{tmp_dir}/api.csv"
+        write_synthetic_singlefile(path, years=["2021"], detail_rows=2)
+        with open(path, "rb") as input:
+            payload = input.read()
+        
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(API_LATENCY)
+                if "/2/" in self.path or "/4/" in self.path:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            def log_message(self, *args):
+                pass
+        
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/{{year}}/{{qtr}}/industry/10.csv"
+        urls = [url.format(year=y, qtr=q) for y in (2022, 2021) for q in "1234"]
+        print(f"{len(urls)} slices of {len(payload)/1e6:.1f} MB, {API_LATENCY} s latency")
+
+        start = time.perf_counter()
+        sequential = []
+        for url in urls:
+            response = requests.get(url)
+            if response.status_code == 200:
+                lines = prefilter_lines(response.content.decode().splitlines())
+                sequential.append(accumulate_rows(csv.DictReader(lines)))
+            else:
+                sequential.append(None)
+        print(f"sequential: {time.perf_counter() - start:6.2f} s")
+
+        start = time.perf_counter()
+        pipeline.API_CACHE = False
+        concurrent = fetch_api_totals(urls)
+        pipeline.API_CACHE = API_CACHE
+        print(f"concurrent: {time.perf_counter() - start:6.2f} s ({API_WORKERS} workers)")
+
+        server.shutdown()
+        assert sequential == concurrent
+#endregion ------------------------------------------------------------------- #
+#region benchmark_crosswalk FUNCTION ----------------------------------------- #
+def benchmark_crosswalk() -> None:
+    '''
+    Compares the time to get the county-to-district crosswalk by executing the
+    `CNTY_FRD_CROSSWALK` literal in config.py with the time a new process 
+    takes to get the compiled array from `load_crosswalk` (its cache is cleared
+    before every call). The compiled array is built from the literal, so it 
+    costs the literal plus compiling; it pays off in the NumPy engine's 
+    whole-array lookups, not at load.
+    '''
+    with open(f"{DIR_ROOT}/01_programs/config.py", "r") as input:
+        source = input.read()
+    start = source.index("CNTY_FRD_CROSSWALK = {")
+    literal = compile(source[start:source.index("}", start) + 1], "config.py", "exec")
+
+    def load_compiled() -> None:
+        load_crosswalk.cache_clear()
+        load_crosswalk()
+
+    n = 100
+    for label, function in (
+        ("execute literal", lambda: exec(literal, {})),
+        ("load compiled array", load_compiled),
+    ):
+        start = time.perf_counter()
+        for _ in range(n):
+            function()
+        print(f"{label:>19}: {(time.perf_counter() - start)/n*1000:7.3f} ms")
+#endregion ------------------------------------------------------------------- #
+#region benchmark_annual FUNCTION -------------------------------------------- #
+def benchmark_annual() -> None:
+    '''
+    Times the "dict" and "numpy" annualization engines on `ANNUAL_YEARS` of
+    synthetic quarterly data and checks that they produce identical JSON.
+    '''
+    rng = random.Random(0)
+    json_data = {
+        f"{year}_{qtr}": {
+            area: {field: rng.randint(0, 10**7) for field in QTRLY_FIELDS}
+            for area in list(FRD_TITLES.keys()) + ["USDPV"]
+        }
+        for year in ANNUAL_YEARS
+        for qtr in ("1", "2", "3", "4")
+    }
+    print(f"synthetic quarterly data: {len(ANNUAL_YEARS)} years")
+
+    n = 20
+    results = {}
+    for engine, function in (("dict", annualize_years), ("numpy", annualize_years_numpy)):
+        start = time.perf_counter()
+        for _ in range(n):
+            annual_data = function(json_data, ANNUAL_YEARS)
+        print(f"{engine:>8}: {(time.perf_counter() - start)/n*1000:7.2f} ms")
+        results[engine] = json.dumps(annual_data, indent=4)
+
+    assert results["dict"] == results["numpy"]
+    print("identical JSON output")
+#endregion ------------------------------------------------------------------- #
+#region benchmark_store FUNCTION --------------------------------------------- #
+def benchmark_store() -> None:
+    '''
+    Times loading `STORE_HISTORY` years of synthetic quarterly data from the
+    JSON file and from the binary store, each followed by reading the last 
+    eight quarters as the API update does. Loading from the store should take
+    the same time however long the history is.
+    '''
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store.DIR_OUTPUT, store.DIR_STORE = tmp_dir, f"{tmp_dir}/store"
+        os.makedirs(f"{tmp_dir}/01_json")
+        for n_years in STORE_HISTORY:
+            json_data = {
+                f"{year}_{qtr}": {
+                    area: {field: rng.randint(0, 10**7) for field in QTRLY_FIELDS}
+                    for area in list(FRD_TITLES.keys()) + ["USDPV"]
+                }
+                for year in range(3000 - n_years, 3000)
+                for qtr in ("1", "2", "3", "4")
+            }
+            store.save_data("quarterly", json_data)
+            recent = list(json_data.keys())[-8:]
+
+            def load_json() -> None:
+                with open(f"{tmp_dir}/01_json/quarterly_data.json", "r") as input:
+                    data = json.load(input)
+                [data[period] for period in recent]
+            def load_store() -> None:
+                data = store.load_data("quarterly")
+                [data[period] for period in recent]
+
+            n = 10
+            for label, function in (("json", load_json), ("store", load_store)):
+                start = time.perf_counter()
+                for _ in range(n):
+                    function()
+                print(f"{n_years:>5} years {label:>6}: {(time.perf_counter() - start)/n*1000:7.2f} ms")
+#endregion ------------------------------------------------------------------- #
+#region benchmark_charts FUNCTION -------------------------------------------- #
+def benchmark_charts() -> None:
+    '''
+    Compares exporting `CHART_COPIES` copies of the README charts cold, each in
+    a fresh process that has to start the image renderer (as every 
+    `write_image` call could), with exporting them as one warm batch with
+    `export_charts`, and checks that the images are identical. Also times
+    rendering them with the built-in SVG renderer (see `render_svg`). With the
+    "svg" `CHART_BACKEND` there is no image renderer to start, so only the SVG
+    rendering is timed.
+    '''
+    import markdown # Needs plotly (and kaleido, to export PNGs), which the other benchmarks do not.
+
+    data = markdown.read_data()
+    latest_year = data[-1]["year"]
+    latest_data = [d for d in data if d["year"] == latest_year]
+    charts = {
+        "pie": markdown.generate_pie_chart(latest_data, latest_year),
+        "bar": markdown.generate_bar_chart(latest_data, latest_year, "oty_annual_avg_emplvl_pct"),
+        "line": markdown.generate_line_chart(data, latest_year, "annual_avg_emplvl"),
+    }
+    names = [f"{name}_{i}.png" for i in range(CHART_COPIES) for name in charts]
+    print(f"{len(names)} charts")
+
+    start = time.perf_counter()
+    for name in names:
+        render_svg(charts[name.split("_")[0]].to_plotly_json())
+    print(f"     svg: {time.perf_counter() - start:6.2f} s")
+    if CHART_BACKEND != "plotly":
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.makedirs(f"{tmp_dir}/cold")
+        os.makedirs(f"{tmp_dir}/warm")
+
+        start = time.perf_counter()
+        for name in names:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                fig = charts[name.split("_")[0]]
+                executor.submit(export_chart_cold, fig, f"{tmp_dir}/cold/{name}").result()
+        print(f"    cold: {time.perf_counter() - start:6.2f} s")
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            figures = {f"{tmp_dir}/warm/{name}": charts[name.split("_")[0]] for name in names}
+            timings = executor.submit(markdown.export_charts, figures).result()
+        print(f"    warm: {time.perf_counter() - start:6.2f} s ({timings['startup']:.2f} s startup)")
+
+        for name in names:
+            with open(f"{tmp_dir}/cold/{name}", "rb") as cold, open(f"{tmp_dir}/warm/{name}", "rb") as warm:
+                assert cold.read() == warm.read()
+        print("identical images")
+#endregion ------------------------------------------------------------------- #
+#region export_chart_cold FUNCTION ------------------------------------------- #
+def export_chart_cold(fig, path: str) -> None:
+    '''
+    Exports a chart figure to a PNG image the way the chart functions used to,
+    with `write_image` in a process whose image renderer has not started.
+    '''
+    fig.write_image(path, scale=6)
+#endregion ------------------------------------------------------------------- #
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region BENCHMARKS
+################################################################################
+BENCHMARKS = {
+    "prefilter": benchmark_prefilter,
+    "engines": benchmark_engines,
+    "api": benchmark_api,
+    "crosswalk": benchmark_crosswalk,
+    "annual": benchmark_annual,
+    "store": benchmark_store,
+    "charts": benchmark_charts,
+}
+################################################################################
+#endregion
+################################################################################
+
+
+
+if __name__ == "__main__":
+    main()
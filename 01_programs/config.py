@@ -14,6 +14,28 @@ import os
 DIR_ROOT = os.path.dirname(os.path.dirname(__file__))
 DIR_INPUT = f"{DIR_ROOT}/02_inputs"
 DIR_OUTPUT = f"{DIR_ROOT}/03_outputs"
+DIR_PARTITIONS = f"{DIR_OUTPUT}/04_partitions"
+DIR_API_CACHE = f"{DIR_OUTPUT}/05_api_cache" # QCEW API validators and running totals. Must persist between runs: keep it committed with the outputs.
+DIR_CACHE = f"{DIR_ROOT}/04_cache"
+DIR_STORE = f"{DIR_CACHE}/store"
+INGEST_WORKERS = os.cpu_count() or 1 # Worker processes for reading DIR_INPUT files (1 = no pool).
+INGEST_SHARD_BYTES = 1 << 26 # Plain CSV files in DIR_INPUT larger than this are read in byte-range shards.
+INPUT_MEMBER_PATTERN = "*.csv" # Members of DIR_INPUT zip archives to read, e.g. "*.singlefile.csv".
+AGGREGATION_ENGINE = "dict" # County-to-district rollup engine: "dict" or "numpy" (requires NumPy).
+ANNUAL_ENGINE = "dict" # Quarterly-to-annual engine: "dict" or "numpy" (requires NumPy).
+INGEST_CACHE = True # Reuse the running totals of DIR_INPUT files that have not changed.
+NPY_STORE = True # Work from a memory-mapped .npy store (requires NumPy); JSON files are exported.
+FUSED_PIPELINE = True # Run main() on one in-memory dataset, writing each output file once.
+ROLLING_OUTPUT = True # Also write trailing four-quarter ("rolling") data for every quarter.
+PARTITIONED_OUTPUT = False # Also write each CSV file split by year and area, with a manifest.
+CHART_BACKEND = "plotly" # Chart renderer in markdown.py: "plotly" (PNG via Kaleido) or "svg" (built-in SVG, no browser).
+CHART_WORKERS = os.cpu_count() or 1 # Worker processes rendering charts in markdown.py (1 = no pool).
+CHART_CACHE = True # Reuse chart images whose figure (data, layout and scale) has not changed.
+CHART_CACHE_SIZE = 50 # Chart images kept in the render cache; the least recently used are evicted.
+API_URL = "http://www.bls.gov/cew/data/api/{year}/{qtr}/industry/10.csv"
+API_WORKERS = 8 # Maximum concurrent QCEW API requests.
+API_TIMEOUT = (10, 120) # Seconds to connect and to wait for data, per QCEW API request.
+API_CACHE = True # Make QCEW API requests conditional and skip slices that have not changed.
 CNTY_FRD_CROSSWALK = { # Based on Tousey (2019): https://doi.org/10.18651/TB/TB1901
     "01001": "FRD06",
     "01003": "FRD06",
@@ -3248,6 +3270,21 @@ CNTY_FRD_CROSSWALK = { # Based on Tousey (2019): https://doi.org/10.18651/TB/TB1
     "78020": "FRD02",
     "78030": "FRD02",
 }
+CNTY_FRD_CROSSWALK_CHANGES = [ # (county, district, first period, last period) for codes valid only part of the time; None = open-ended.
+    # Connecticut planning regions, which replace its counties from 2022. Each
+    # is assigned the district of the former county holding most of its people.
+    ("09110", "FRD01", "2022_1", None), # Capitol
+    ("09120", "FRD02", "2022_1", None), # Greater Bridgeport
+    ("09130", "FRD01", "2022_1", None), # Lower Connecticut River Valley
+    ("09140", "FRD01", "2022_1", None), # Naugatuck Valley
+    ("09150", "FRD01", "2022_1", None), # Northeastern Connecticut
+    ("09160", "FRD01", "2022_1", None), # Northwest Hills
+    ("09170", "FRD01", "2022_1", None), # South Central Connecticut
+    ("09180", "FRD01", "2022_1", None), # Southeastern Connecticut
+    ("09190", "FRD02", "2022_1", None), # Western Connecticut
+    # Dade County, FL, renamed Miami-Dade (12086) in 1997.
+    ("12025", "FRD06", None, "1997_4"),
+]
 FRD_TITLES = {
     "FRD01": "Boston",
     "FRD02": "New York",
@@ -0,0 +1,113 @@
+################################################################################
+#region IMPORTS
+################################################################################
+from config import *
+from functools import lru_cache
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region CONSTANTS
+################################################################################
+CROSSWALK_SIZE = 100000 # Numeric county FIPS codes (state*1000 + county) are all below this.
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region FUNCTIONS
+################################################################################
+#region load_crosswalk FUNCTION ---------------------------------------------- #
+@lru_cache(maxsize=None)
+def load_crosswalk() -> bytes:
+    '''
+    Gets the compiled county-to-district crosswalk (see `compile_crosswalk`). 
+    `CNTY_FRD_CROSSWALK` is compiled once per process, the first time it is
+    needed.
+    '''
+    return(compile_crosswalk(CNTY_FRD_CROSSWALK))
+#endregion ------------------------------------------------------------------- #
+#region period_crosswalk FUNCTION -------------------------------------------- #
+def period_crosswalk(period: str) -> dict:
+    '''
+    Gets the county-to-district crosswalk in effect in a period ("YYYY_Q"):
+    `CNTY_FRD_CROSSWALK` with the entries of `CNTY_FRD_CROSSWALK_CHANGES` whose
+    period range covers it. Periods with the same entries in effect share one
+    lookup table, so a county resolves with a single dict lookup.
+    '''
+    return(version_crosswalk(crosswalk_version(period)))
+#endregion ------------------------------------------------------------------- #
+#region period_compiled_crosswalk FUNCTION ----------------------------------- #
+def period_compiled_crosswalk(period: str) -> bytes:
+    '''
+    Compiled version of `period_crosswalk` (see `compile_crosswalk`): the array
+    from `load_crosswalk` with the changes in effect in the period patched in.
+    '''
+    return(version_compiled_crosswalk(crosswalk_version(period)))
+#endregion ------------------------------------------------------------------- #
+#region crosswalk_version FUNCTION ------------------------------------------- #
+@lru_cache(maxsize=None)
+def crosswalk_version(period: str) -> tuple:
+    '''
+    Gets the positions in `CNTY_FRD_CROSSWALK_CHANGES` of the entries in effect
+    in a period. Period codes ("YYYY_Q") sort in time order as strings.
+    '''
+    return(tuple(
+        i for i, (cnty, district, first, last) in enumerate(CNTY_FRD_CROSSWALK_CHANGES)
+        if (first is None or first <= period) and (last is None or period <= last)
+    ))
+#endregion ------------------------------------------------------------------- #
+#region version_crosswalk FUNCTION ------------------------------------------- #
+@lru_cache(maxsize=None)
+def version_crosswalk(version: tuple) -> dict:
+    '''
+    Builds the lookup table for a set of `CNTY_FRD_CROSSWALK_CHANGES` entries
+    (see `crosswalk_version`).
+    '''
+    crosswalk = dict(CNTY_FRD_CROSSWALK)
+    for i in version:
+        cnty, district, first, last = CNTY_FRD_CROSSWALK_CHANGES[i]
+        crosswalk[cnty] = district
+    return(crosswalk)
+#endregion ------------------------------------------------------------------- #
+#region version_compiled_crosswalk FUNCTION ---------------------------------- #
+@lru_cache(maxsize=None)
+def version_compiled_crosswalk(version: tuple) -> bytes:
+    '''
+    Builds the compiled lookup table for a set of `CNTY_FRD_CROSSWALK_CHANGES`
+    entries (see `crosswalk_version`).
+    '''
+    compiled = bytearray(load_crosswalk())
+    for i in version:
+        cnty, district, first, last = CNTY_FRD_CROSSWALK_CHANGES[i]
+        compiled[int(cnty)] = district_number(district)
+    return(bytes(compiled))
+#endregion ------------------------------------------------------------------- #
+#region compile_crosswalk FUNCTION ------------------------------------------- #
+def compile_crosswalk(crosswalk: dict) -> bytes:
+    '''
+    Compiles a county-to-district crosswalk into a dense array of
+    `CROSSWALK_SIZE` bytes, indexed by numeric county FIPS code. Each byte holds
+    the district number (e.g. 6 for "FRD06"), or 0 if the county is not in the
+    crosswalk.
+    '''
+    compiled = bytearray(CROSSWALK_SIZE)
+    for cnty, district in crosswalk.items():
+        compiled[int(cnty)] = district_number(district)
+    return(bytes(compiled))
+#endregion ------------------------------------------------------------------- #
+#region district_number FUNCTION --------------------------------------------- #
+def district_number(district: str) -> int:
+    '''
+    Gets the number of a Federal Reserve district code (e.g. 6 for "FRD06").
+    '''
+    return(int(district[3:]))
+#endregion ------------------------------------------------------------------- #
+################################################################################
+#endregion
+################################################################################
@@ -2,8 +2,46 @@
 #region IMPORTS
 ################################################################################
 from config import *
-from collections import defaultdict
-import csv, datetime, json, os, requests
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from crosswalk import district_number, period_compiled_crosswalk, period_crosswalk
+from fnmatch import fnmatch
+from itertools import chain, groupby, islice
+from operator import itemgetter
+from outputs import file_digest, open_if_changed, write_if_changed
+from store import StoredData, load_data, save_data, sort_periods
+from timing import print_timings, stage_timer
+from typing import BinaryIO, Iterable, Iterator, TextIO
+import codecs, csv, datetime, gzip, hashlib, io, json, os, requests, requests.adapters, zipfile
+try:
+    import numpy as np
+except ImportError:
+    np = None
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region CONSTANTS
+################################################################################
+DISTRICTS_BY_STATE = {} # The set of Federal Reserve districts each state belongs to.
+for cnty, district in CNTY_FRD_CROSSWALK.items():
+    DISTRICTS_BY_STATE.setdefault(cnty[0:2], set()).add(district)
+for cnty, district, first, last in CNTY_FRD_CROSSWALK_CHANGES:
+    DISTRICTS_BY_STATE.setdefault(cnty[0:2], set()).add(district)
+AGGLVL_CODES = ("50", "70") # State and county totals; all other rows are skipped.
+STATE_DISTRICTS = [ # (state, district) pairs, indexed by the NumPy engine.
+    (state, district)
+    for state, districts in DISTRICTS_BY_STATE.items()
+    for district in sorted(districts)
+]
+NUMPY_CHUNK_ROWS = 100000 # Rows parsed per chunk by the NumPy engine.
+API_CHUNK_SIZE = 1 << 16 # Bytes read at a time from QCEW API responses.
+INGEST_CACHE_KEY = hashlib.sha256( # Changes whenever cached running totals would.
+    json.dumps([CNTY_FRD_CROSSWALK, CNTY_FRD_CROSSWALK_CHANGES, AGGLVL_CODES, QTRLY_FIELDS, INPUT_MEMBER_PATTERN]).encode()
+).hexdigest()
 ################################################################################
 #endregion
 ################################################################################
@@ -15,95 +53,559 @@ import csv, datetime, json, os, requests
 ################################################################################
 #region main FUNCTION -------------------------------------------------------- #
 def main() -> None:
-    # Generate quarterly JSON data if it does not yet exist.
-    if not os.path.exists(f"{DIR_OUTPUT}/01_json/quarterly_data.json"):
-        generate_qtrly_json()
+    timings = {}
+
+    # Run the stages on one in-memory dataset, if so configured.
+    if FUSED_PIPELINE:
+        run_fused_pipeline(timings)
+        print_timings(timings)
+        return
+
+    # Generate quarterly JSON data if it does not yet exist. The annual JSON
+    # data are then regenerated in full.
+    generated = not os.path.exists(f"{DIR_OUTPUT}/01_json/quarterly_data.json")
+    if generated:
+        with stage_timer("generate quarterly", timings):
+            generate_qtrly_json()
     
     # Update quarterly JSON data with new data from BLS's QCEW API.
-    update_qtrly_json()
+    with stage_timer("update quarterly", timings):
+        changed_periods = update_qtrly_json()
 
-    # (Re)-Generate the annual JSON data.
-    generate_annual_json()
+    # (Re)-Generate the annual JSON data for the years whose quarters changed.
+    with stage_timer("generate annual", timings):
+        generate_annual_json(None if generated else changed_periods)
     
-    # Generate quarterly and annual CSV data.
-    for i in ["quarterly", "annual"]:
-        generate_csv(i)
+    # (Re)-Generate the rolling JSON data for the quarters whose trailing four
+    # quarters changed, if so configured.
+    if ROLLING_OUTPUT:
+        with stage_timer("generate rolling", timings):
+            generate_rolling_json(None if generated else changed_periods)
+    
+    # Generate quarterly, annual, and rolling CSV data.
+    for i in ["quarterly", "annual"] + (["rolling"] if ROLLING_OUTPUT else []):
+        with stage_timer(f"generate {i} CSV", timings):
+            generate_csv(i)
+    print_timings(timings)
+#endregion ------------------------------------------------------------------- #
+#region run_fused_pipeline FUNCTION ------------------------------------------ #
+def run_fused_pipeline(timings: dict) -> None:
+    '''
+    Runs the same stages as `main`, but loads the quarterly dataset once and 
+    updates, annualizes, and exports it from memory, so that every output file
+    is written exactly once and nothing is read back in.
+    When the datasets are opened from the store, only the periods the stages 
+    use are read, and datasets that did not change are not exported again.
+    '''
+    # Load the quarterly data, generating it from the historical source files
+    # if it does not yet exist. The annual data are then rebuilt in full.
+    generated = not os.path.exists(f"{DIR_OUTPUT}/01_json/quarterly_data.json")
+    if generated:
+        with stage_timer("build quarterly", timings):
+            json_data = build_qtrly_data()
+    else:
+        with stage_timer("load quarterly", timings):
+            json_data = load_data("quarterly")
+    
+    # Update the quarterly data with new data from BLS's QCEW API.
+    with stage_timer("update quarterly", timings):
+        changed_periods = update_qtrly_data(json_data)
+    
+    # Annualize the quarterly data, recomputing only the years whose quarters
+    # changed when the annual data already exist.
+    annual_data = None
+    if not generated and os.path.exists(f"{DIR_OUTPUT}/01_json/annual_data.json"):
+        with stage_timer("load annual", timings):
+            annual_data = load_data("annual")
+    with stage_timer("build annual", timings):
+        annual_data = build_annual_data(json_data, annual_data, changed_periods)
+    datasets = [("quarterly", json_data), ("annual", annual_data)]
+    
+    # Build the trailing four-quarter data the same way, if so configured.
+    if ROLLING_OUTPUT:
+        rolling_data = None
+        if not generated and os.path.exists(f"{DIR_OUTPUT}/01_json/rolling_data.json"):
+            with stage_timer("load rolling", timings):
+                rolling_data = load_data("rolling")
+        with stage_timer("build rolling", timings):
+            rolling_data = build_rolling_data(json_data, rolling_data, changed_periods)
+        datasets.append(("rolling", rolling_data))
+    
+    # Export and save the datasets. A dataset opened from the store that did 
+    # not change is skipped, as its exports are already up to date. The store
+    # is saved after the CSV files, so a run that stops part way through leaves
+    # the store behind and the next run exports the changes again.
+    for i, data in datasets:
+        if (
+            isinstance(data, StoredData)
+            and not data.changed
+            and os.path.exists(f"{DIR_OUTPUT}/02_csv/{i}_data.csv")
+            and (not PARTITIONED_OUTPUT or os.path.exists(f"{DIR_PARTITIONS}/{i}/manifest.json"))
+        ):
+            continue
+        with stage_timer(f"write {i} CSV", timings):
+            write_csv(i, data)
+        if PARTITIONED_OUTPUT:
+            with stage_timer(f"write {i} partitions", timings):
+                write_partitions(i, data)
+        with stage_timer(f"save {i}", timings):
+            save_data(i, data)
 #endregion ------------------------------------------------------------------- #
 #region generate_qtrly_database FUNCTION ------------------------------------- #
 def generate_qtrly_json() -> None:
     '''
     Creates a quarterly JSON database using historical source files downloaded
     from the Bureau of Labor Statistics' Quarterly Census of Employment and 
-    Wages (QCEW) to the source directory (`DIR_INPUT`).
+    Wages (QCEW) to the source directory (`DIR_INPUT`). Source files may be 
+    plain CSVs or the `.zip`/`.gz` archives as downloaded.
+    '''
+    # Save the data to the data store and export it to a JSON file.
+    save_data("quarterly", build_qtrly_data())
+#endregion ------------------------------------------------------------------- #
+#region build_qtrly_data FUNCTION -------------------------------------------- #
+def build_qtrly_data() -> dict:
+    '''
+    Builds the quarterly data from the historical source files in `DIR_INPUT`.
     '''
+    # Get the running totals of any source files that were already read on an 
+    # earlier run from the ingestion cache. Only new or changed files need to 
+    # be read.
+    paths = [f"{DIR_INPUT}/{file}" for file in sorted(os.listdir(DIR_INPUT))]
+    fingerprints, totals_by_path = read_cached_totals(paths)
+    pending = [path for path in paths if path not in totals_by_path]
+    
+    # Read the remaining source files, splitting large plain CSV files into
+    # byte-range shards (see `shard_file`). When `INGEST_WORKERS` allows it, 
+    # each shard is read by its own worker process, which sends back only its
+    # running totals. The shards of each file are merged back together in 
+    # order.
+    shards = [(path, start, end) for path in pending for start, end in shard_file(path)]
+    workers = min(INGEST_WORKERS, len(shards))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            shard_totals = list(executor.map(ingest_shard, shards))
+    else:
+        shard_totals = list(map(ingest_shard, shards))
+    for (path, start, end), totals in zip(shards, shard_totals):
+        totals_by_path[path] = merge_totals(totals_by_path.setdefault(path, {}), totals)
+    write_cached_totals(fingerprints, totals_by_path, pending)
+
     # Initialize an empty dictionary, then update the dictionary with data from
-    # the source QCEW files.
+    # the source QCEW files in file name order, so the output does not depend on
+    # the number of workers or on which files came from the cache.
     json_data = {}
-    for file in os.listdir(DIR_INPUT):
-        with open(f"{DIR_INPUT}/{file}", "r") as input:
-            csv_reader = csv.DictReader(input)
-            json_data.update(aggregate_data(csv_reader))
+    for path in paths:
+        json_data.update(finalize_totals(totals_by_path[path]))
+    
+    # Return the data dictionary.
+    return(json_data)
+#endregion ------------------------------------------------------------------- #
+#region ingest_file FUNCTION ------------------------------------------------- #
+def ingest_file(path: str) -> dict:
+    '''
+    Reads one historical QCEW source file into running totals (see 
+    `accumulate_lines`). Runs in a worker process when files are ingested in
+    parallel. All matching members of a zip archive go into the same totals.
+    '''
+    totals = {}
+    for input in open_sources(path):
+        accumulate_lines(prefilter_lines(input), totals)
+    return(totals)
+#endregion ------------------------------------------------------------------- #
+#region shard_file FUNCTION -------------------------------------------------- #
+def shard_file(path: str) -> list[tuple[int, int]]:
+    '''
+    Splits a source file into byte ranges of about `INGEST_SHARD_BYTES` each,
+    for `ingest_shard`. Compressed files cannot be read from an offset, so
+    they (and small plain files) are one shard, `(0, None)`.
+    '''
+    size = os.path.getsize(path)
+    if path.endswith((".zip", ".gz")) or size <= INGEST_SHARD_BYTES:
+        return([(0, None)])
+    starts = list(range(0, size, INGEST_SHARD_BYTES))
+    return(list(zip(starts, starts[1:] + [size])))
+#endregion ------------------------------------------------------------------- #
+#region ingest_shard FUNCTION ------------------------------------------------ #
+def ingest_shard(shard: tuple[str, int, int]) -> dict:
+    '''
+    Reads one byte range, `(path, start, end)`, of a plain CSV source file into
+    running totals (see `accumulate_lines`). A range holds every line that 
+    starts within it, read with the file's header; QCEW fields never contain
+    line breaks, so lines are never split between shards. An `end` of `None`
+    reads the whole file with `ingest_file`.
+    '''
+    path, start, end = shard
+    if end is None:
+        return(ingest_file(path))
+    
+    with open(path, "rb") as input:
+        header = input.readline()
+        
+        # Skip the line the range starts in the middle of, if any; it belongs
+        # to the previous shard.
+        if start > input.tell():
+            input.seek(start - 1)
+            input.readline()
+        
+        # Stream the lines that start within the range, finishing its last 
+        # line, straight into the running totals.
+        return(accumulate_lines(prefilter_lines(
+            chain([header.decode()], iter_range_lines(input, end))
+        )))
+#endregion ------------------------------------------------------------------- #
+#region iter_range_lines FUNCTION -------------------------------------------- #
+def iter_range_lines(input: BinaryIO, end: int) -> Iterator[str]:
+    '''
+    Yields the lines of a binary file, decoded, from its current position, that
+    start before byte `end`. The last line is read to its end even if it runs
+    past `end`. One line is held in memory at a time.
+    '''
+    position = input.tell()
+    while position < end:
+        line = input.readline()
+        if not line:
+            return
+        position += len(line)
+        yield line.decode()
+#endregion ------------------------------------------------------------------- #
+#region read_cached_totals FUNCTION ------------------------------------------ #
+def read_cached_totals(paths: list[str]) -> tuple[dict, dict]:
+    '''
+    Looks up source files in the ingestion cache. Returns the fingerprint of 
+    every file and the cached running totals of the files whose fingerprint is
+    in the cache.
+    '''
+    if not INGEST_CACHE:
+        return({}, {})
+
+    cache_index = read_cache_index(f"{DIR_CACHE}/ingest")
+    fingerprints = {}
+    totals_by_path = {}
+    for path in paths:
+        fingerprints[path] = fingerprint_file(path, cache_index.get(os.path.basename(path)))
+        totals = read_cache_totals(f"{DIR_CACHE}/ingest", fingerprints[path]["sha256"])
+        if totals is not None:
+            totals_by_path[path] = totals
+    
+    return(fingerprints, totals_by_path)
+#endregion ------------------------------------------------------------------- #
+#region write_cached_totals FUNCTION ----------------------------------------- #
+def write_cached_totals(fingerprints: dict, totals_by_path: dict, 
+                        pending: list[str]) -> None:
+    '''
+    Saves the running totals of newly read source files to the ingestion cache
+    and rewrites the cache index. Cached totals of files that are no longer in
+    `DIR_INPUT` are removed.
+    '''
+    if not INGEST_CACHE:
+        return
+    
+    cache_index = {os.path.basename(path): fingerprints[path] for path in fingerprints}
+    new_totals = {fingerprints[path]["sha256"]: totals_by_path[path] for path in pending}
+    write_cache(f"{DIR_CACHE}/ingest", cache_index, new_totals)
+#endregion ------------------------------------------------------------------- #
+#region read_cache_index FUNCTION -------------------------------------------- #
+def read_cache_index(directory: str) -> dict:
+    '''
+    Reads the index of a running totals cache: `DIR_CACHE`/ingest for source 
+    files, or `DIR_API_CACHE` for QCEW API slices. Index entries all have a 
+    "sha256" content hash, which names the cached running totals.
+    '''
+    if not os.path.exists(f"{directory}/index.json"):
+        return({})
+    with open(f"{directory}/index.json", "r") as input:
+        return(json.load(input))
+#endregion ------------------------------------------------------------------- #
+#region read_cache_totals FUNCTION ------------------------------------------- #
+def read_cache_totals(directory: str, sha256: str) -> dict:
+    '''
+    Reads cached running totals by content hash. Returns `None` if there are
+    none, or if they were made with different ingestion settings (see 
+    `INGEST_CACHE_KEY`).
+    '''
+    cache_file = f"{directory}/{sha256}.json"
+    if not os.path.exists(cache_file):
+        return(None)
+    with open(cache_file, "rb") as input:
+        try:
+            return(deserialize_totals(input.read()))
+        except ValueError:
+            return(None)
+#endregion ------------------------------------------------------------------- #
+#region write_cache FUNCTION ------------------------------------------------- #
+def write_cache(directory: str, cache_index: dict, new_totals: dict) -> None:
+    '''
+    Saves newly computed running totals (keyed by content hash) and the index
+    of a running totals cache. Cached totals that the index no longer refers
+    to are removed. Unchanged files are not rewritten (see `write_if_changed`),
+    so a cache kept under version control only changes when its content does.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    for sha256, totals in new_totals.items():
+        write_if_changed(f"{directory}/{sha256}.json", serialize_totals(totals))
+    
+    write_if_changed(f"{directory}/index.json", json.dumps(cache_index, indent=4).encode())
     
-    # Write the dictionary out to a JSON file.
-    with open(f"{DIR_OUTPUT}/01_json/quarterly_data.json", "w") as output:
-        json.dump(json_data, output, indent=4)
+    in_use = set(f"{entry['sha256']}.json" for entry in cache_index.values())
+    for file in os.listdir(directory):
+        if file != "index.json" and file not in in_use:
+            os.remove(f"{directory}/{file}")
+#endregion ------------------------------------------------------------------- #
+#region fingerprint_file FUNCTION -------------------------------------------- #
+def fingerprint_file(path: str, cached: dict = None) -> dict:
+    '''
+    Gets the size, modification time, and SHA-256 content hash of a file. If 
+    the size and modification time match the `cached` fingerprint, the file is
+    not hashed again.
+    '''
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if cached is not None and all(cached.get(k) == v for k, v in fingerprint.items()):
+        return(cached)
+    
+    fingerprint["sha256"] = file_digest(path)
+    return(fingerprint)
+#endregion ------------------------------------------------------------------- #
+#region open_sources FUNCTION ------------------------------------------------ #
+def open_sources(path: str) -> Iterator[TextIO]:
+    '''
+    Yields the CSV text streams contained in a source file. Plain files are
+    opened as they are; `.gz` files are decompressed and `.zip` archives have
+    each member whose name matches `INPUT_MEMBER_PATTERN` opened in turn. 
+    Compressed data is decompressed and decoded incrementally as it is read, so
+    archives never have to be extracted to disk or held in memory.
+    '''
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.infolist():
+                name = os.path.basename(member.filename)
+                if member.is_dir() or not fnmatch(name, INPUT_MEMBER_PATTERN):
+                    continue
+                with archive.open(member) as raw:
+                    yield io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    elif path.endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8", newline="") as input:
+            yield input
+    else:
+        with open(path, "r") as input:
+            yield input
 #endregion ------------------------------------------------------------------- #
 #region update_qtrly_database FUNCTION --------------------------------------- #
-def update_qtrly_json() -> None:
+def update_qtrly_json() -> list[str]:
     '''
     Updates the quarterly JSON database with any new data from the Bureau of 
     Labor Statistics' Quarterly Census of Employment and Wages (QCEW) API.
+    Returns the periods that were added or changed.
+    '''
+    # Read in the existing database, update it, then save it to the data store
+    # and export it to a JSON file.
+    json_data = load_data("quarterly")
+    changed_periods = update_qtrly_data(json_data)
+    save_data("quarterly", json_data)
+    return(changed_periods)
+#endregion ------------------------------------------------------------------- #
+#region update_qtrly_data FUNCTION ------------------------------------------- #
+def update_qtrly_data(json_data: dict) -> list[str]:
+    '''
+    Updates the quarterly data in place with any new data from the QCEW API.
+    Returns the periods that were added or changed.
     '''
-    # Read in the existing database.
-    with open(f"{DIR_OUTPUT}/01_json/quarterly_data.json", "r") as input:
-        json_data = json.load(input)
-
     # Update the database for all quarters this year and last year, if these
     # data are available. QCEW data are revised four times after they are 
     # first published, so it is necessary each quarter to update the 
     # database with the revised, back-quarter data.
     current_year = datetime.date.today().year
-    for year in [current_year, current_year - 1]:
-        for qtr in ["1", "2", "3", "4"]:
-            url = f"http://www.bls.gov/cew/data/api/{year}/{qtr}/industry/10.csv"
-            response = requests.get(url)
-            if response.status_code == 200:
-                csv_reader = csv.DictReader(
-                    response.content.decode().splitlines()
-                )
-                json_data.update(aggregate_data(csv_reader))
-
-    # Write the data out to a JSON file.
-    with open(f"{DIR_OUTPUT}/01_json/quarterly_data.json", "w") as output:
-        json.dump(json_data, output, indent=4)
+    urls = [
+        API_URL.format(year=year, qtr=qtr)
+        for year in [current_year, current_year - 1]
+        for qtr in ["1", "2", "3", "4"]
+    ]
+    changed_periods = []
+    for totals in fetch_api_totals(urls):
+        if totals is not None:
+            for period, areas in finalize_totals(totals).items():
+                if json_data.get(period) != areas and period not in changed_periods:
+                    changed_periods.append(period)
+                json_data[period] = areas
+    
+    # Return the added or changed periods.
+    return(changed_periods)
+#endregion ------------------------------------------------------------------- #
+#region fetch_api_totals FUNCTION -------------------------------------------- #
+def fetch_api_totals(urls: list[str]) -> list[dict]:
+    '''
+    Fetches QCEW API data slices concurrently over one pooled HTTP session, 
+    with at most `API_WORKERS` requests in flight and a timeout of 
+    `API_TIMEOUT` seconds per request. Returns the running totals for each URL
+    in the order given (`None` where no data are available).
+
+    When `API_CACHE` is on, the ETag/Last-Modified validators and a digest of
+    each slice are kept in the API cache (`DIR_API_CACHE`) with the slice's 
+    running totals, and requests are made conditional on them. A slice that 
+    has not changed (a 304 response) is neither downloaded nor parsed again.
+    The API cache sits beside the outputs and is committed with them, so that
+    runs from a fresh checkout (e.g. scheduled jobs) still have it.
+    '''
+    cache_index = read_cache_index(DIR_API_CACHE) if API_CACHE else {}
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=API_WORKERS)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with ThreadPoolExecutor(max_workers=API_WORKERS) as executor:
+            results = list(executor.map(
+                lambda url: fetch_api_slice(session, url, cache_index.get(url)), 
+                urls
+            ))
+    
+    # Save the validators of every available slice and the running totals of
+    # any slices that were parsed. The API cache is not created until there is
+    # a slice to cache.
+    if API_CACHE:
+        cache_index = {}
+        new_totals = {}
+        for url, (totals, entry, parsed) in zip(urls, results):
+            if entry is not None:
+                cache_index[url] = entry
+                if parsed:
+                    new_totals[entry["sha256"]] = totals
+        if cache_index or os.path.exists(f"{DIR_API_CACHE}/index.json"):
+            write_cache(DIR_API_CACHE, cache_index, new_totals)
+    
+    return([totals for totals, entry, parsed in results])
+#endregion ------------------------------------------------------------------- #
+#region fetch_api_slice FUNCTION --------------------------------------------- #
+def fetch_api_slice(session: requests.Session, url: str, 
+                    cached: dict = None) -> tuple[dict, dict, bool]:
+    '''
+    Fetches one QCEW API data slice and reads it into running totals while it
+    downloads. If the slice is in the API cache (`cached`), the request is 
+    conditional, and the cached running totals are used when the slice has not
+    changed. Returns the running totals (`None` if the slice is not available),
+    the slice's cache entry, and whether the slice was parsed.
+    '''
+    headers = {}
+    if cached is not None:
+        if cached["etag"] is not None:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"] is not None:
+            headers["If-Modified-Since"] = cached["last_modified"]
+    
+    with session.get(url, headers=headers, timeout=API_TIMEOUT, stream=True) as response:
+        if response.status_code == 304:
+            totals = read_cache_totals(DIR_API_CACHE, cached["sha256"])
+            if totals is None:
+                return(fetch_api_slice(session, url))
+            return(totals, cached, False)
+        if response.status_code != 200:
+            return(None, None, False)
+        
+        # Parse the slice chunk by chunk as it arrives, hashing the raw bytes 
+        # along the way.
+        sha256 = hashlib.sha256()
+        chunks = response.iter_content(chunk_size=API_CHUNK_SIZE)
+        totals = accumulate_lines(prefilter_lines(decode_lines(chunks, sha256)))
+        entry = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": sha256.hexdigest(),
+        }
+    
+    return(totals, entry, True)
+#endregion ------------------------------------------------------------------- #
+#region decode_lines FUNCTION ------------------------------------------------ #
+def decode_lines(chunks: Iterable[bytes], digest: object = None) -> Iterator[str]:
+    '''
+    Decodes a stream of UTF-8 byte chunks into lines of text without holding
+    more than one chunk (and one partial line) at a time. If a `digest` is 
+    given, it is updated with every chunk.
+    '''
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    partial_line = ""
+    for chunk in chunks:
+        if digest is not None:
+            digest.update(chunk)
+        lines = (partial_line + decoder.decode(chunk)).split("\n")
+        partial_line = lines.pop()
+        yield from lines
+    partial_line += decoder.decode(b"", final=True)
+    if partial_line:
+        yield partial_line
 #endregion ------------------------------------------------------------------- #
 #region generate_annual_database FUNCTION ------------------------------------ #
-def generate_annual_json() -> None:
+def generate_annual_json(changed_periods: list[str] = None) -> None:
+    '''
+    Creates an annual JSON database from the quarterly JSON database. If the
+    quarterly periods that changed since the annual database was last created
+    are given, only their years are recomputed.
+    '''
+    # Read in the quarterly database and any annual database to patch.
+    annual_data = None
+    if changed_periods is not None and os.path.exists(f"{DIR_OUTPUT}/01_json/annual_data.json"):
+        if not changed_periods:
+            return
+        annual_data = load_data("annual")
+    json_data = load_data("quarterly")
+
+    # Annualize the quarterly data, then save the annual data to the data store
+    # and export it to a JSON file.
+    save_data("annual", build_annual_data(json_data, annual_data, changed_periods))
+#endregion ------------------------------------------------------------------- #
+#region build_annual_data FUNCTION ------------------------------------------- #
+def build_annual_data(json_data: dict, annual_data: dict = None, 
+                      changed_periods: list[str] = None) -> dict:
     '''
-    Creates an annual JSON database from the quarterly JSON database.
+    Builds the annual data from the quarterly data. Only years with all four
+    quarters are included. Given existing `annual_data` and the quarterly
+    periods that changed since it was built, only the years of those periods
+    are recomputed and patched into it (in place), so the work does not grow
+    with the length of the history.
     '''
-    # Read in the quarterly database.
-    with open(f"{DIR_OUTPUT}/01_json/quarterly_data.json", "r") as input:
-        json_data = json.load(input)
+    # Get the years to (re)compute.
+    if annual_data is None or changed_periods is None:
+        annual_data = {}
+        years = set([period[0:4] for period in json_data.keys()])
+    else:
+        years = set([period[0:4] for period in changed_periods])
 
+    # Annualize the years that have all four quarters, and drop any others.
+    complete_years = []
+    for year in sorted(list(years)):
+        if all([f"{year}_{qtr}" in json_data for qtr in ["1", "2", "3", "4"]]):
+            complete_years.append(year)
+        else:
+            annual_data.pop(f"{year}_A", None)
+    if ANNUAL_ENGINE == "numpy":
+        new_data = annualize_years_numpy(json_data, complete_years)
+    else:
+        new_data = annualize_years(json_data, complete_years)
+    
+    # Patch the recomputed years into the annual data, keeping years in order.
+    annual_data.update(new_data)
+    sort_periods(annual_data)
+    
+    # Return the annual data dictionary.
+    return(annual_data)
+#endregion ------------------------------------------------------------------- #
+#region annualize_years FUNCTION --------------------------------------------- #
+def annualize_years(json_data: dict, years: list[str]) -> dict:
+    '''
+    Computes the annual data for the given years, which must all have four
+    quarters in the quarterly data.
+    '''
     # Initialize annual data.
     annual_data = {}
-    periods = list(json_data.keys())
-    years = set([period[0:4] for period in periods])
-    for year in sorted(list(years)):
-        if all([f"{year}_{qtr}" in periods for qtr in ["1", "2", "3", "4"]]):
-            period = f"{year}_A"
-            annual_data[period] = {}
-            for area in FRD_TITLES.keys():
-                annual_data[period][area] = defaultdict(int)
-            annual_data[period]["USDPV"] = defaultdict(int)
+    for year in years:
+        period = f"{year}_A"
+        annual_data[period] = {}
+        for area in FRD_TITLES.keys():
+            annual_data[period][area] = defaultdict(int)
+        annual_data[period]["USDPV"] = defaultdict(int)
     
     # Aggregate annual data.
-    for period, areas in json_data.items():
-        annual_period = f"{period[0:4]}_A"
-        if annual_period in annual_data.keys():
-            for area, fields in areas.items():
-                dict = annual_data[annual_period][area]
+    for annual_period, annual_areas in annual_data.items():
+        for qtr in ["1", "2", "3", "4"]:
+            for area, fields in json_data[f"{annual_period[0:4]}_{qtr}"].items():
+                dict = annual_areas[area]
                 dict["annual_avg_estabs_count"] += fields["qtrly_estabs_count"]
                 for m in ("1", "2", "3"):
                     dict["annual_avg_emplvl"] += fields[f"month{m}_emplvl"]
@@ -112,65 +614,501 @@ def generate_annual_json() -> None:
     # Finalize annual averages.
     for areas in annual_data.values():
         for fields in areas.values():
-            for field in ("annual_avg_estabs_count", "annual_avg_emplvl"):
-                denominator = 4 if field == "annual_avg_estabs_count" else 12
-                fields[field] = round(fields[field]/denominator)
-            emp = fields["annual_avg_emplvl"]
-            if emp > 0:
-                pay = round(fields["total_annual_wages"]/emp)
-                fields["annual_avg_wkly_wage"] = round(pay/52)
-                fields["avg_annual_pay"] = pay
-            else:
-                fields["annual_avg_wkly_wage"] = None
-                fields["avg_annual_pay"] = None
+            finalize_annual_fields(fields)
+    
+    # Return the annual data dictionary.
+    return(annual_data)
+#endregion ------------------------------------------------------------------- #
+#region finalize_annual_fields FUNCTION -------------------------------------- #
+def finalize_annual_fields(fields: dict) -> dict:
+    '''
+    Turns four quarters of summed establishment counts, monthly employment, and
+    wages for one area (in place) into annual averages, total wages, and 
+    average annual and weekly pay. Pay is `None` when average employment is 0.
+    '''
+    for field in ("annual_avg_estabs_count", "annual_avg_emplvl"):
+        denominator = 4 if field == "annual_avg_estabs_count" else 12
+        fields[field] = round(fields[field]/denominator)
+    emp = fields["annual_avg_emplvl"]
+    if emp > 0:
+        pay = round(fields["total_annual_wages"]/emp)
+        fields["annual_avg_wkly_wage"] = round(pay/52)
+        fields["avg_annual_pay"] = pay
+    else:
+        fields["annual_avg_wkly_wage"] = None
+        fields["avg_annual_pay"] = None
+    return(fields)
+#endregion ------------------------------------------------------------------- #
+#region annualize_years_numpy FUNCTION --------------------------------------- #
+def annualize_years_numpy(json_data: dict, years: list[str]) -> dict:
+    '''
+    Array version of `annualize_years`, used when `ANNUAL_ENGINE` is "numpy".
+    The quarterly data are laid out as a (year, quarter, area, field) int64 
+    array and annualized with whole-array operations. `np.round` rounds halves
+    to even on the same float64 quotients as `round`, so the results are 
+    identical, including `None` wages where average employment rounds to 0.
+    '''
+    if np is None:
+        raise ImportError('ANNUAL_ENGINE = "numpy" requires NumPy.')
+    if not years:
+        return({})
     
-    # Write the data out to a JSON file.
-    with open(f"{DIR_OUTPUT}/01_json/annual_data.json", "w") as output:
-        json.dump(annual_data, output, indent=4)
+    # Lay the quarterly data out as a (year, quarter, area, field) array.
+    areas = list(FRD_TITLES.keys()) + ["USDPV"]
+    get_fields = itemgetter(*QTRLY_FIELDS)
+    cube = np.array(
+        [
+            get_fields(json_data[f"{year}_{qtr}"][area])
+            for year in years
+            for qtr in ["1", "2", "3", "4"]
+            for area in areas
+        ],
+        dtype=np.int64
+    ).reshape(len(years), 4, len(areas), len(QTRLY_FIELDS))
+    
+    # Sum over quarters (and months), then take the annual averages.
+    sums = cube.sum(axis=1)
+    estabs = np.round(sums[:, :, QTRLY_FIELDS.index("qtrly_estabs_count")]/4).astype(np.int64)
+    months = [QTRLY_FIELDS.index(f"month{m}_emplvl") for m in ("1", "2", "3")]
+    emp = np.round(sums[:, :, months].sum(axis=2)/12).astype(np.int64)
+    wages = sums[:, :, QTRLY_FIELDS.index("total_qtrly_wages")]
+    has_emp = emp > 0
+    pay = np.round(wages/np.where(has_emp, emp, 1)).astype(np.int64)
+    wkly_wage = np.round(pay/52).astype(np.int64)
+
+    # Convert the arrays back into the annual data dictionary.
+    columns = [array.tolist() for array in (estabs, emp, wages, wkly_wage, pay, has_emp)]
+    annual_data = {}
+    for y, year in enumerate(years):
+        annual_data[f"{year}_A"] = {}
+        for a, area in enumerate(areas):
+            estabs, emp, wages, wkly_wage, pay, has_emp = [column[y][a] for column in columns]
+            annual_data[f"{year}_A"][area] = {
+                "annual_avg_estabs_count": estabs,
+                "annual_avg_emplvl": emp,
+                "total_annual_wages": wages,
+                "annual_avg_wkly_wage": wkly_wage if has_emp else None,
+                "avg_annual_pay": pay if has_emp else None,
+            }
+    
+    # Return the annual data dictionary.
+    return(annual_data)
+#endregion ------------------------------------------------------------------- #
+#region generate_rolling_database FUNCTION ----------------------------------- #
+def generate_rolling_json(changed_periods: list[str] = None) -> None:
+    '''
+    Creates a trailing four-quarter ("rolling") JSON database from the 
+    quarterly JSON database. If the quarterly periods that changed since the
+    rolling database was last created are given, only the quarters whose 
+    trailing four quarters include them are recomputed.
+    '''
+    # Read in the quarterly database and any rolling database to patch.
+    rolling_data = None
+    if changed_periods is not None and os.path.exists(f"{DIR_OUTPUT}/01_json/rolling_data.json"):
+        if not changed_periods:
+            return
+        rolling_data = load_data("rolling")
+    json_data = load_data("quarterly")
+
+    # Compute the trailing four-quarter data, then save them to the data store
+    # and export them to a JSON file.
+    save_data("rolling", build_rolling_data(json_data, rolling_data, changed_periods))
+#endregion ------------------------------------------------------------------- #
+#region build_rolling_data FUNCTION ------------------------------------------ #
+def build_rolling_data(json_data: dict, rolling_data: dict = None, 
+                       changed_periods: list[str] = None) -> dict:
+    '''
+    Builds trailing four-quarter data from the quarterly data: for every 
+    quarter that ends four consecutive quarters, the same averages and totals
+    as the annual data, over those four quarters. A window of running sums is
+    slid over the quarters in order, adding each new quarter and dropping the
+    one four quarters back, so every quarter costs the same amount of work. 
+    Given existing `rolling_data` and the quarterly periods that changed since
+    it was built, the window starts three quarters before the earliest change
+    and its results are patched into `rolling_data` (in place).
+    '''
+    # Get the quarters to (re)compute.
+    periods = sorted(json_data.keys())
+    if rolling_data is None or changed_periods is None:
+        rolling_data = {}
+        changed_periods = periods
+    if not changed_periods:
+        return(rolling_data)
+    first_changed = min(changed_periods)
+    period = shift_period(first_changed, -3)
+    
+    # Slide the window over the quarters, from the three quarters that lead up
+    # to the earliest change. A missing quarter empties the window.
+    window = deque()
+    sums = {}
+    while period <= periods[-1]:
+        if period not in json_data:
+            window.clear()
+            sums = {}
+            if period >= first_changed:
+                rolling_data.pop(period, None)
+            period = shift_period(period, 1)
+            continue
+        
+        # Add the new quarter to the window, and drop the oldest one once the
+        # window holds more than four.
+        values = {}
+        for area, fields in json_data[period].items():
+            values[area] = [
+                fields["qtrly_estabs_count"],
+                sum(fields[f"month{m}_emplvl"] for m in ("1", "2", "3")),
+                fields["total_qtrly_wages"],
+            ]
+            area_sums = sums.setdefault(area, [0, 0, 0])
+            for i, value in enumerate(values[area]):
+                area_sums[i] += value
+        window.append(values)
+        if len(window) > 4:
+            for area, old_values in window.popleft().items():
+                for i, value in enumerate(old_values):
+                    sums[area][i] -= value
+        
+        # Finalize the trailing four-quarter averages of the quarters being
+        # (re)computed.
+        if period >= first_changed and len(window) == 4:
+            rolling_data[period] = {
+                area: finalize_annual_fields({
+                    "annual_avg_estabs_count": estabs,
+                    "annual_avg_emplvl": emplvl,
+                    "total_annual_wages": wages,
+                })
+                for area, (estabs, emplvl, wages) in sums.items()
+            }
+        elif period >= first_changed:
+            rolling_data.pop(period, None)
+        period = shift_period(period, 1)
+    
+    # Keep quarters in order.
+    sort_periods(rolling_data)
+    
+    # Return the rolling data dictionary.
+    return(rolling_data)
+#endregion ------------------------------------------------------------------- #
+#region shift_period FUNCTION ------------------------------------------------ #
+def shift_period(period: str, quarters: int) -> str:
+    '''
+    Shifts a quarterly period code ("YYYY_Q") by a number of quarters.
+    '''
+    index = int(period[0:4])*4 + int(period[5]) - 1 + quarters
+    return(f"{index // 4}_{index % 4 + 1}")
 #endregion ------------------------------------------------------------------- #
 #region aggregate_data FUNCTION ---------------------------------------------- #
 def aggregate_data(csv_reader: csv.DictReader) -> dict:
     '''
     Aggregates county-level QCEW data to the Federal Reserve district level.
     '''
-    # Read in the QCEW data.
-    qcew_slice = [dict for dict in csv_reader]
+    # Read the QCEW data one row at a time into running totals, then turn the 
+    # totals into the finished district-level data.
+    totals = accumulate_rows(csv_reader)
+    
+    # Return the data dictionary.
+    return(finalize_totals(totals))
+#endregion ------------------------------------------------------------------- #
+#region accumulate_rows FUNCTION --------------------------------------------- #
+def accumulate_rows(csv_reader: csv.DictReader, totals: dict = None) -> dict:
+    '''
+    Adds each row of a QCEW data slice to running totals, reading each row only
+    once. For every period, the totals hold the disclosed county data summed by
+    Federal Reserve district, all county data summed by state and district (for
+    the district shares), the disclosed 99x county rows, and the U.S. Total. 
+    Values are kept as lists in the same order as `QTRLY_FIELDS`, so memory
+    grows with the number of periods and districts rather than the number of 
+    rows.
+    '''
+    totals = {} if totals is None else totals
+
+    # Fix field titling discrepancy between API-based and non-API-based QCEW 
+    # data slices.
+    fields = list(QTRLY_FIELDS)
+    if "qtrly_estabs_count" not in (csv_reader.fieldnames or fields):
+        fields[fields.index("qtrly_estabs_count")] = "qtrly_estabs"
+
+    crosswalks = {} # The crosswalk in effect in each period (see `period_crosswalk`).
+    for row in csv_reader:
+        period = f"{row['year']}_{row['qtr']}"
+        if period not in crosswalks:
+            crosswalks[period] = period_crosswalk(period)
+        if period not in totals:
+            totals[period] = new_period_totals()
+        period_totals = totals[period]
+        agglvl_code = row["agglvl_code"]
+        if agglvl_code == "70":
+            cnty_fips = row["area_fips"]
+            state = cnty_fips[0:2]
+            if cnty_fips[2:4] != "99":
+                values = [int(row[field]) for field in fields]
+                district = crosswalks[period][cnty_fips]
+                if state not in period_totals["states"]:
+                    period_totals["states"][state] = new_state_totals(state)
+                state_sums = period_totals["states"][state][district]
+                for i, value in enumerate(values):
+                    state_sums[i] += value
+                if row["disclosure_code"] == "":
+                    district_sums = period_totals["districts"][district]
+                    for i, value in enumerate(values):
+                        district_sums[i] += value
+            elif row["disclosure_code"] == "":
+                values = [int(row[field]) for field in fields]
+                period_totals["99x"].append((state, values))
+        elif agglvl_code == "50":
+            us_sums = period_totals["USDPV"]
+            for i, field in enumerate(fields):
+                us_sums[i] += int(row[field])
     
+    # Return the running totals.
+    return(totals)
+#endregion ------------------------------------------------------------------- #
+#region accumulate_lines FUNCTION -------------------------------------------- #
+def accumulate_lines(lines: Iterable[str], totals: dict = None) -> dict:
+    '''
+    Adds the lines (header first) of a QCEW data slice to running totals with
+    the `AGGREGATION_ENGINE`: decoded row by row with `accumulate_rows`, or 
+    parsed in bulk with `accumulate_lines_numpy`.
+    '''
+    if AGGREGATION_ENGINE == "numpy":
+        return(accumulate_lines_numpy(lines, totals))
+    return(accumulate_rows(csv.DictReader(lines), totals))
+#endregion ------------------------------------------------------------------- #
+#region accumulate_lines_numpy FUNCTION -------------------------------------- #
+def accumulate_lines_numpy(lines: Iterable[str], totals: dict = None) -> dict:
+    '''
+    Columnar version of `accumulate_rows`, used when `AGGREGATION_ENGINE` is 
+    "numpy". Lines are taken in chunks of `NUMPY_CHUNK_ROWS` and only the 
+    needed columns are parsed, in bulk, by `np.loadtxt` into a structured array,
+    so no row goes through Python on its own. Each chunk is rolled up with 
+    `np.add.at` into (period, district, field) and (period, state-district, 
+    field) cubes before being added to the running totals. Counties are mapped
+    to districts with whole-array lookups in the compiled crosswalk of their
+    period (see `period_compiled_crosswalk`). The running totals are the same 
+    as those from `accumulate_rows`.
+    '''
+    if np is None:
+        raise ImportError('AGGREGATION_ENGINE = "numpy" requires NumPy.')
+    totals = {} if totals is None else totals
+    lines = iter(lines)
+    header = next(lines, None)
+    if header is None:
+        return(totals)
+    header_fields = next(csv.reader([header]))
+
     # Fix field titling discrepancy between API-based and non-API-based QCEW 
     # data slices.
-    for dict in qcew_slice:
-        if "qtrly_estabs_count" not in dict.keys():
-            dict["qtrly_estabs_count"] = dict["qtrly_estabs"]
-            del dict["qtrly_estabs"]
+    fields = list(QTRLY_FIELDS)
+    if "qtrly_estabs_count" not in header_fields:
+        fields[fields.index("qtrly_estabs_count")] = "qtrly_estabs"
+    
+    # Get the columns to parse, in file order, and their types. The FIPS codes
+    # of state and county rows (the only rows kept by `prefilter_lines`) are 
+    # all numeric.
+    types = {"area_fips": "i8", "year": "i8", "qtr": "i8", "agglvl_code": "i8", "disclosure_code": "U8"}
+    types.update({field: "i8" for field in fields})
+    usecols = sorted(header_fields.index(column) for column in types)
+    dtype = [(header_fields[i], types[header_fields[i]]) for i in usecols]
+    
+    # Look up districts in the compiled crosswalk in effect in each period, then
+    # translate district numbers to positions in `FRD_TITLES` and (state, 
+    # district number) to positions in `STATE_DISTRICTS`.
+    district_index = np.zeros(100, dtype=np.int64)
+    for i, area in enumerate(FRD_TITLES):
+        district_index[district_number(area)] = i
+    pair_index = np.zeros((100, 100), dtype=np.int64)
+    for pair, (state, district) in enumerate(STATE_DISTRICTS):
+        pair_index[int(state), district_number(district)] = pair
+
+    # Parse the lines in chunks.
+    while True:
+        batch = list(islice(lines, NUMPY_CHUNK_ROWS))
+        if not batch:
+            break
+        table = np.loadtxt(
+            batch, delimiter=",", quotechar='"', dtype=dtype, usecols=usecols, ndmin=1
+        )
+        if len(table) == 0:
+            continue
+        area_fips = table["area_fips"]
+        agglvl_code = table["agglvl_code"]
+        values = np.stack([table[field] for field in fields], axis=1)
+
+        # Index the rows by period, keeping periods in order of appearance.
+        period_keys, first, period_idx = np.unique(
+            table["year"]*10 + table["qtr"], return_index=True, return_inverse=True
+        )
+        periods = [f"{key // 10}_{key % 10}" for key in period_keys.tolist()]
+        for p in np.argsort(first):
+            if periods[p] not in totals:
+                totals[periods[p]] = new_period_totals()
+
+        # Map non-99x counties to their district and state-district pair 
+        # through the compiled crosswalk of their period.
+        crosswalks = np.stack([
+            np.frombuffer(period_compiled_crosswalk(period), dtype=np.uint8)
+            for period in periods
+        ])
+        is_disclosed = table["disclosure_code"] == ""
+        county_rows = np.flatnonzero(agglvl_code == 70)
+        county_fips = area_fips[county_rows]
+        is_99x = county_fips % 1000 // 10 == 99
+        counties = county_rows[~is_99x]
+        cnty_fips = county_fips[~is_99x]
+        district_numbers = crosswalks[period_idx[counties], cnty_fips]
+        if not district_numbers.all():
+            raise KeyError(f"{area_fips[counties[district_numbers == 0][0]]:05d}")
+        district_idx = np.zeros(len(table), dtype=np.int64)
+        pair_idx = np.zeros(len(table), dtype=np.int64)
+        district_idx[counties] = district_index[district_numbers]
+        pair_idx[counties] = pair_index[cnty_fips // 1000, district_numbers]
+        disclosed_counties = counties[is_disclosed[counties]]
+        us_rows = np.flatnonzero(agglvl_code == 50)
+
+        # Roll the chunk up into cubes.
+        district_cube = np.zeros((len(periods), len(FRD_TITLES), len(fields)), dtype=np.int64)
+        np.add.at(
+            district_cube,
+            (period_idx[disclosed_counties], district_idx[disclosed_counties]),
+            values[disclosed_counties]
+        )
+        pair_cube = np.zeros((len(periods), len(STATE_DISTRICTS), len(fields)), dtype=np.int64)
+        np.add.at(pair_cube, (period_idx[counties], pair_idx[counties]), values[counties])
+        pair_rows = np.zeros((len(periods), len(STATE_DISTRICTS)), dtype=np.int64)
+        np.add.at(pair_rows, (period_idx[counties], pair_idx[counties]), 1)
+        us_cube = np.zeros((len(periods), len(fields)), dtype=np.int64)
+        np.add.at(us_cube, period_idx[us_rows], values[us_rows])
+
+        # Add the cubes to the running totals.
+        for p, period in enumerate(periods):
+            period_totals = totals[period]
+            for area, sums in zip(FRD_TITLES, district_cube[p].tolist()):
+                target = period_totals["districts"][area]
+                for i, value in enumerate(sums):
+                    target[i] += value
+            for pair in np.flatnonzero(pair_rows[p]):
+                state, district = STATE_DISTRICTS[pair]
+                if state not in period_totals["states"]:
+                    period_totals["states"][state] = new_state_totals(state)
+                target = period_totals["states"][state][district]
+                for i, value in enumerate(pair_cube[p, pair].tolist()):
+                    target[i] += value
+            target = period_totals["USDPV"]
+            for i, value in enumerate(us_cube[p].tolist()):
+                target[i] += value
+        
+        # Hold back the disclosed 99x county rows.
+        for i in county_rows[is_99x & is_disclosed[county_rows]].tolist():
+            period = periods[period_idx[i]]
+            totals[period]["99x"].append((f"{area_fips[i] // 1000:02d}", values[i].tolist()))
     
+    # Return the running totals.
+    return(totals)
+#endregion ------------------------------------------------------------------- #
+#region new_period_totals FUNCTION ------------------------------------------- #
+def new_period_totals() -> dict:
+    '''
+    Gets empty running totals for one period (see `merge_totals`).
+    '''
+    return({
+        "districts": {area: [0]*len(QTRLY_FIELDS) for area in FRD_TITLES},
+        "states": {},
+        "99x": [],
+        "USDPV": [0]*len(QTRLY_FIELDS),
+    })
+#endregion ------------------------------------------------------------------- #
+#region new_state_totals FUNCTION -------------------------------------------- #
+def new_state_totals(state: str) -> dict:
+    '''
+    Gets empty running totals for one state of a period: one list of sums per
+    Federal Reserve district the state belongs to.
+    '''
+    return({district: [0]*len(QTRLY_FIELDS) for district in sorted(DISTRICTS_BY_STATE[state])})
+#endregion ------------------------------------------------------------------- #
+#region merge_totals FUNCTION ------------------------------------------------ #
+def merge_totals(totals: dict, other: dict) -> dict:
+    '''
+    Adds the running totals `other` into `totals` (in place) and returns them.
+    Running totals are partial aggregates: raw sums by period and district, by
+    period, state, and district, and of the U.S. Total, plus the disclosed 99x
+    county rows. Merging them is associative, so a data slice can be read in 
+    shards (byte ranges of a file, groups of states) on any number of processes
+    or machines, merged in any grouping, and finalized once with 
+    `finalize_totals`, with the same result as reading it whole. The 99x rows 
+    are kept one by one because `finalize_totals` rounds each row's share 
+    separately. New periods are added in the order they appear in `other`.
+    '''
+    for period, other_totals in other.items():
+        if period not in totals:
+            totals[period] = new_period_totals()
+        period_totals = totals[period]
+        for area, values in other_totals["districts"].items():
+            target = period_totals["districts"][area]
+            for i, value in enumerate(values):
+                target[i] += value
+        for state, districts in other_totals["states"].items():
+            if state not in period_totals["states"]:
+                period_totals["states"][state] = new_state_totals(state)
+            for district, values in districts.items():
+                target = period_totals["states"][state][district]
+                for i, value in enumerate(values):
+                    target[i] += value
+        period_totals["99x"].extend(other_totals["99x"])
+        target = period_totals["USDPV"]
+        for i, value in enumerate(other_totals["USDPV"]):
+            target[i] += value
+    
+    # Return the merged running totals.
+    return(totals)
+#endregion ------------------------------------------------------------------- #
+#region serialize_totals FUNCTION -------------------------------------------- #
+def serialize_totals(totals: dict) -> bytes:
+    '''
+    Serializes running totals as compact JSON, tagged with `INGEST_CACHE_KEY`
+    so that totals made with different ingestion settings (e.g. another 
+    crosswalk) are never merged. Keys are sorted, so the same totals always
+    serialize to the same bytes.
+    '''
+    return(json.dumps(
+        {"key": INGEST_CACHE_KEY, "totals": totals}, separators=(",", ":"), sort_keys=True
+    ).encode())
+#endregion ------------------------------------------------------------------- #
+#region deserialize_totals FUNCTION ------------------------------------------ #
+def deserialize_totals(serialized: bytes) -> dict:
+    '''
+    Reads running totals written by `serialize_totals`. Raises `ValueError` if
+    they were made with different ingestion settings.
+    '''
+    serialized = json.loads(serialized)
+    if serialized["key"] != INGEST_CACHE_KEY:
+        raise ValueError("Running totals were made with different ingestion settings.")
+    return(serialized["totals"])
+#endregion ------------------------------------------------------------------- #
+#region finalize_totals FUNCTION --------------------------------------------- #
+def finalize_totals(totals: dict) -> dict:
+    '''
+    Turns the running totals from `accumulate_rows` into district-level data: 
+    distributes the 99x county rows across districts, computes the FRD99 
+    residuals, and adds average weekly wages.
+    '''
     # Get the distribution of the data across Federal Reserve districts for each 
     # state.
-    district_shares = get_district_shares(qcew_slice)
+    district_shares = get_district_shares(totals)
 
-    # Aggregate the county-level total data to the Federal Reserve district 
-    # level. Also aggregate the state-level total data to the U.S. Total.
+    # Start from the county-level totals for each Federal Reserve district and
+    # the state-level totals for the U.S. Total.
     data = {}
-    for row in qcew_slice:
-        period = f"{row['year']}_{row['qtr']}"
-        if period not in data:
-            data[period] = {}
-            for area in FRD_TITLES.keys():
-                data[period][area] = defaultdict(int)
-            data[period]["USDPV"] = defaultdict(int)
-        if row["agglvl_code"] == "70" and row["disclosure_code"] == "":
-            cnty_fips = row["area_fips"]
-            if cnty_fips[2:4] != "99":
-                area = CNTY_FRD_CROSSWALK[cnty_fips]
-                for field in QTRLY_FIELDS:
-                    data[period][area][field] += int(row[field])
-            else:
-                state_fips = cnty_fips[0:2]
-                for area, fields in district_shares[period][state_fips].items():
-                    for field, weight in fields.items():
-                        data[period][area][field] += round(int(row[field])*weight)
-        elif row["agglvl_code"] == "50":
-            for field in QTRLY_FIELDS:
-                data[period]["USDPV"][field] += int(row[field])
+    for period, period_totals in totals.items():
+        data[period] = {}
+        for area, values in period_totals["districts"].items():
+            data[period][area] = dict(zip(QTRLY_FIELDS, values))
+        data[period]["USDPV"] = dict(zip(QTRLY_FIELDS, period_totals["USDPV"]))
+        
+        # Distribute the 99x county data across the state's districts.
+        for state_fips, values in period_totals["99x"]:
+            for area, weights in district_shares[period][state_fips].items():
+                for field, weight, value in zip(QTRLY_FIELDS, weights, values):
+                    data[period][area][field] += round(value*weight)
     
     # Get FRD99 totals, which are the differences between the U.S. Totals and 
     # the sum across the twelve Federal Reserve Districts.
@@ -194,54 +1132,52 @@ def aggregate_data(csv_reader: csv.DictReader) -> dict:
     # Return the data dictionary.
     return(data)
 #endregion ------------------------------------------------------------------- #
+#region prefilter_lines FUNCTION --------------------------------------------- #
+def prefilter_lines(lines: Iterable[str]) -> Iterator[str]:
+    '''
+    Drops raw QCEW CSV lines whose `agglvl_code` is not in `AGGLVL_CODES` before
+    they are decoded into dictionaries. The `agglvl_code` column is located from
+    the header; the columns before it (FIPS, ownership, and industry codes) 
+    never contain commas, so a bounded split of the raw line is enough to read
+    it. Sources without an `agglvl_code` column are passed through unchanged.
+    '''
+    lines = iter(lines)
+    header = next(lines, None)
+    if header is None:
+        return
+    yield header
+
+    header_fields = next(csv.reader([header]))
+    if "agglvl_code" not in header_fields:
+        yield from lines
+        return
+    
+    column = header_fields.index("agglvl_code")
+    keep = set(AGGLVL_CODES) | {f'"{code}"' for code in AGGLVL_CODES}
+    for line in lines:
+        values = line.split(",", column + 1)
+        if len(values) > column and values[column].strip() in keep:
+            yield line
+#endregion ------------------------------------------------------------------- #
 #region get_district_shares FUNCTION ----------------------------------------- #
-def get_district_shares(qcew_slice: list[dict]) -> dict:
+def get_district_shares(totals: dict) -> dict:
     '''
     Gets the distribution of the data across Federal Reserve districts for
     each state. These distributions are needed later in order to aggregate 99x 
     county data for states belonging to more than one Federal Reserve district.
     '''
-    # Get the set of Federal Reserve districts each state belongs to.
-    districts_by_state = defaultdict(set)
-    for cnty, district in CNTY_FRD_CROSSWALK.items():
-        districts_by_state[cnty[0:2]].add(district)
-    
-    # For all non-99x counties, aggregate data to the Federal Reserve district 
-    # level. All non-99x counties are associated with a single district.
-    district_shares = {}
-    for row in qcew_slice:
-        period = f"{row['year']}_{row['qtr']}"
-        if period not in district_shares:
-            district_shares[period] = {}
-            for state, districts in districts_by_state.items():
-                district_shares[period][state] = {}
-                for district in districts:
-                    district_shares[period][state][district] = defaultdict(int)
-        if row["agglvl_code"] == "70":
-            cnty_fips = row["area_fips"]
-            if cnty_fips[2:4] != "99":
-                state = cnty_fips[0:2]
-                district = CNTY_FRD_CROSSWALK[cnty_fips]
-                for field in QTRLY_FIELDS:
-                    district_shares[period][state][district][field] += int(row[field])
-    
     # For each state, get the distribution of non-99x data across Federal 
-    # Reserve districts.
-    for period, states in district_shares.items():
-        for state, districts in states.items():
-            state_totals = defaultdict(int)
-            for district, fields in districts.items():
-                for field, value in fields.items():
-                    state_totals[field] += value
-            
-            dict = district_shares[period][state]
-            for field, state_total in state_totals.items():
-                for district in districts.keys():
-                    if state_total > 0:
-                        district_total = dict[district][field]
-                        dict[district][field] = district_total/state_total
-                    else:
-                        dict[district][field] = None
+    # Reserve districts. States without any non-99x data have no distribution.
+    district_shares = {}
+    for period, period_totals in totals.items():
+        district_shares[period] = {state: {} for state in DISTRICTS_BY_STATE}
+        for state, districts in period_totals["states"].items():
+            state_totals = [sum(column) for column in zip(*districts.values())]
+            for district, values in districts.items():
+                district_shares[period][state][district] = [
+                    value/state_total if state_total > 0 else None
+                    for value, state_total in zip(values, state_totals)
+                ]
     
     # Return the district shares dictionary.
     return(district_shares)
@@ -251,45 +1187,120 @@ def generate_csv(i: str) -> None:
     '''
     Generates a CSV file containing all of the establishment, employment, and
     wage data for Federal Reserve districts over-time. `i` should either be: 
-    "quarterly" or "annual".
+    "quarterly", "annual", or "rolling". When `PARTITIONED_OUTPUT` is on, the
+    data are also written out in partitions (see `write_partitions`).
     '''
-    with open(f"{DIR_OUTPUT}/01_json/{i}_data.json", "r") as input:
-        json_data = json.load(input)
-
-    # Construct the CSV data as a list of dictionaries. Don't include records 
-    # with zero data on the file.
-    csv_data = []
-    for period, area_codes in json_data.items():
-        year, qtr = tuple(period.split("_"))
-        for area_code, fields in area_codes.items():
-            zeroed = True
-            for field, value in fields.items():
-                if isinstance(value, int) and value > 0:
-                    zeroed = False
-            if not zeroed:
-                csv_row = {
-                    "year": year,
-                    "qtr": qtr,
-                    "area_code": area_code,
-                    "area_title": "Total U.S." if area_code == "USDPV" else f"{FRD_TITLES[area_code]} -- Federal Reserve District",
-                }
-                for field, value in fields.items():
-                    csv_row[field] = value
-                csv_data.append(csv_row)
-    
-    # Sort the CSV data by year, quarter, and area.
-    sort_cols = ["year", "qtr", "area_code"]
-    csv_data = sorted(csv_data, key=lambda d: [d[col] for col in sort_cols])
+    json_data = load_data(i)
+    write_csv(i, json_data)
+    if PARTITIONED_OUTPUT:
+        write_partitions(i, json_data)
+#endregion ------------------------------------------------------------------- #
+#region write_csv FUNCTION --------------------------------------------------- #
+def write_csv(i: str, json_data: dict) -> None:
+    '''
+    Writes the "quarterly", "annual", or "rolling" data out to its CSV file. 
+    Rows are streamed to the file in year, quarter, and area order, which only
+    takes ordering the periods and the areas within each period; no list of all
+    rows is built and no rows are sorted. The file is replaced atomically, and
+    only if its content changed (see `open_if_changed`).
+    '''
+    rows = iter_csv_rows(json_data)
+    first_row = next(rows, None)
 
     # Write out the CSV data.
-    with open(f"{DIR_OUTPUT}/02_csv/{i}_data.csv", "w") as output:
+    with open_if_changed(f"{DIR_OUTPUT}/02_csv/{i}_data.csv") as output:
+        if first_row is None:
+            return
         csv_writer = csv.DictWriter(
             output,
-            fieldnames=csv_data[0].keys(),
+            fieldnames=first_row.keys(),
             lineterminator="\n"
         )
         csv_writer.writeheader()
-        csv_writer.writerows(csv_data)
+        csv_writer.writerow(first_row)
+        csv_writer.writerows(rows)
+#endregion ------------------------------------------------------------------- #
+#region write_partitions FUNCTION -------------------------------------------- #
+def write_partitions(i: str, json_data: dict) -> None:
+    '''
+    Writes the "quarterly", "annual", or "rolling" data out as one CSV file per
+    year and area (`DIR_PARTITIONS`/{i}/{year}/{area_code}.csv), laid out like
+    the full CSV file, so readers can open only the partitions they need. A
+    manifest (manifest.json) lists every partition with its size in bytes, row
+    count, first and last period, and SHA-256 digest. Partitions whose content
+    is unchanged are not rewritten (see `write_if_changed`), and partitions 
+    that no longer have any rows are removed, along with any year directories
+    left empty. One year of rows is held in memory at a time.
+    '''
+    directory = f"{DIR_PARTITIONS}/{i}"
+    os.makedirs(directory, exist_ok=True)
+    manifest = {"partitions": {}}
+    if os.path.exists(f"{directory}/manifest.json"):
+        with open(f"{directory}/manifest.json", "r") as input:
+            manifest = json.load(input)
+    
+    # Render each year's rows by area, and write the partitions that changed.
+    partitions = {}
+    for year, rows in groupby(iter_csv_rows(json_data), key=itemgetter("year")):
+        rows_by_area = {}
+        for csv_row in rows:
+            rows_by_area.setdefault(csv_row["area_code"], []).append(csv_row)
+        for area_code, area_rows in rows_by_area.items():
+            buffer = io.StringIO()
+            csv_writer = csv.DictWriter(
+                buffer,
+                fieldnames=area_rows[0].keys(),
+                lineterminator="\n"
+            )
+            csv_writer.writeheader()
+            csv_writer.writerows(area_rows)
+            content = buffer.getvalue().encode()
+            path = f"{year}/{area_code}.csv"
+            partitions[path] = {
+                "year": year,
+                "area_code": area_code,
+                "bytes": len(content),
+                "rows": len(area_rows),
+                "first_period": f"{year}_{area_rows[0]['qtr']}",
+                "last_period": f"{year}_{area_rows[-1]['qtr']}",
+                "sha256": hashlib.sha256(content).hexdigest(),
+            }
+            os.makedirs(f"{directory}/{year}", exist_ok=True)
+            write_if_changed(f"{directory}/{path}", content)
+    
+    # Remove partitions that are no longer in the data, and any year 
+    # directories this leaves empty.
+    for path in manifest["partitions"]:
+        if path not in partitions and os.path.exists(f"{directory}/{path}"):
+            os.remove(f"{directory}/{path}")
+            if not os.listdir(os.path.dirname(f"{directory}/{path}")):
+                os.rmdir(os.path.dirname(f"{directory}/{path}"))
+    
+    # Write the manifest last, so it only lists partitions that are in place.
+    manifest = json.dumps({"partitions": partitions}, indent=4).encode()
+    write_if_changed(f"{directory}/manifest.json", manifest)
+#endregion ------------------------------------------------------------------- #
+#region iter_csv_rows FUNCTION ----------------------------------------------- #
+def iter_csv_rows(json_data: dict) -> Iterator[dict]:
+    '''
+    Yields the CSV rows of a dataset one at a time, sorted by year, quarter, 
+    and area. Records with zero data are not included.
+    '''
+    for period in sorted(json_data.keys(), key=lambda period: period.split("_")):
+        year, qtr = tuple(period.split("_"))
+        area_codes = json_data[period]
+        for area_code in sorted(area_codes.keys()):
+            fields = area_codes[area_code]
+            if not any(isinstance(value, int) and value > 0 for value in fields.values()):
+                continue
+            csv_row = {
+                "year": year,
+                "qtr": qtr,
+                "area_code": area_code,
+                "area_title": "Total U.S." if area_code == "USDPV" else f"{FRD_TITLES[area_code]} -- Federal Reserve District",
+            }
+            csv_row.update(fields)
+            yield csv_row
 #endregion ------------------------------------------------------------------- #
 ################################################################################
 #endregion
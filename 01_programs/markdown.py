@@ -2,7 +2,13 @@
 #region IMPORTS
 ################################################################################
 from config import *
-import csv, datetime
+from concurrent.futures import ProcessPoolExecutor
+from outputs import write_if_changed
+from store import NULL_VALUE, load_arrays
+from svg import render_svg
+from timing import print_timings, stage_timer
+import datetime, hashlib, importlib.metadata, json, os, time
+import plotly, numpy as np, plotly.graph_objects as go, plotly.io as pio
 import plotly_express as px
 from collections import defaultdict
 ################################################################################
@@ -44,13 +50,11 @@ CHART_ATTRS = {
     "Dallas": {"color": "#f15b23", "dash": "solid"},
     "San Francisco": {"color": "#f09406", "dash": "solid"},
 }
-CSV_DATA_TYPES = {
-    "area_code": str,
-    "year": str,
-    "area_title": str,
-    "annual_avg_emplvl": int,
-    "avg_annual_pay": int,
-}
+CHART_FIELDS = ["annual_avg_emplvl", "avg_annual_pay"] # Annual fields read by `read_data`.
+CHANGE_LAGS = {"oty": 1, "otd": 10} # Changes read by `read_data`, as prefix: years (e.g. "ot5y": 5).
+CHART_SCALE = 6 # Scale factor of exported chart images.
+CHART_FORMAT = "svg" if CHART_BACKEND == "svg" else "png" # Image format of the charts `CHART_BACKEND` exports.
+CHART_CACHE_DIR = f"{DIR_CACHE}/charts"
 ################################################################################
 #endregion
 ################################################################################
@@ -62,9 +66,11 @@ CSV_DATA_TYPES = {
 ################################################################################
 #region main FUNCTION -------------------------------------------------------- #
 def main() -> None:
+    timings = {}
 
     # Read in the data.
-    longitudinal_data = read_data()
+    with stage_timer("read data", timings):
+        longitudinal_data = read_data()
 
     # Get the most recent year.
     latest_year = longitudinal_data[-1]["year"]
@@ -72,76 +78,293 @@ def main() -> None:
     # Get the data belonging to the most recent year-quarter.
     latest_data = [d for d in longitudinal_data if d["year"] == latest_year]
     
-    # Generate pie chart image.
-    generate_pie_chart(latest_data, latest_year)
-    
-    # Generate bar chart images.
-    for field in ("oty_annual_avg_emplvl_pct", "oty_avg_annual_pay_pct"):
-        generate_bar_chart(latest_data, latest_year, field)
+    # Build the chart figures: the pie chart, the bar charts, and the line 
+    # charts.
+    with stage_timer("build charts", timings):
+        figures = {
+            f"{DIR_OUTPUT}/03_charts/pie_annual_avg_emplvl.{CHART_FORMAT}": 
+                generate_pie_chart(latest_data, latest_year)
+        }
+        for field in ("oty_annual_avg_emplvl_pct", "oty_avg_annual_pay_pct"):
+            figures[f"{DIR_OUTPUT}/03_charts/bar_{field}.{CHART_FORMAT}"] = (
+                generate_bar_chart(latest_data, latest_year, field)
+            )
+        for field in ("annual_avg_emplvl", "avg_annual_pay"):
+            figures[f"{DIR_OUTPUT}/03_charts/line_{field}.{CHART_FORMAT}"] = (
+                generate_line_chart(longitudinal_data, latest_year, field)
+            )
+
+    # Reuse the cached images of figures that have not changed since they were
+    # last rendered (see `CHART_CACHE`).
+    with stage_timer("read chart cache", timings):
+        digests = {path: chart_digest(fig) for path, fig in figures.items()}
+        cache_index = read_chart_cache_index()
+        cached = load_cached_charts(digests, cache_index)
+    pending = {path: fig for path, fig in figures.items() if path not in cached}
+
+    # Export the other chart images in batches, one per worker process when 
+    # `CHART_WORKERS` allows it, each with its own warm renderer (see 
+    # `export_charts`), and write the markdown (.MD) file while they render.
+    # SVG images take milliseconds, so they are not worth a worker pool.
+    workers = min(CHART_WORKERS, len(pending)) if CHART_BACKEND == "plotly" else 1
+    if workers > 1:
+        paths = list(pending.keys())
+        batches = [{path: pending[path] for path in paths[w::workers]} for w in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(export_charts, batch) for batch in batches]
+            with stage_timer("write markdown", timings):
+                write_markdown(longitudinal_data, latest_year)
+            with stage_timer("wait for charts", timings):
+                batch_timings = [future.result() for future in futures]
+    else:
+        with stage_timer("export charts", timings):
+            batch_timings = [export_charts(pending)] if pending else []
+        with stage_timer("write markdown", timings):
+            write_markdown(longitudinal_data, latest_year)
+
+    # Add the new images to the chart cache.
+    with stage_timer("write chart cache", timings):
+        evicted = write_chart_cache(digests, cache_index, cached)
     
-    # Generate line chart images.
-    for field in ("annual_avg_emplvl", "avg_annual_pay"):
-        generate_line_chart(longitudinal_data, latest_year, field)
-
-    # Write the markdown (.MD) file.
-    write_markdown(longitudinal_data, latest_year)
+    # Print the renderer startup time of each batch, the export time of each
+    # chart, the chart cache metrics, and the wall time of each stage.
+    for batch in batch_timings:
+        print(f"{'renderer startup':<40}{batch.pop('startup'):8.3f} s")
+    for batch in batch_timings:
+        for path, seconds in batch.items():
+            print(f"{os.path.basename(path):<40}{seconds:8.3f} s")
+    for path in cached:
+        print(f"{os.path.basename(path):<40}{'cached':>8}")
+    if CHART_CACHE:
+        print(
+            f"chart cache: {len(cached)} hits, {len(pending)} misses "
+            f"({len(cached)/len(figures):.0%} hit rate), {evicted} evicted"
+        )
+    print_timings(timings)
+#endregion ------------------------------------------------------------------- #
+#region export_charts FUNCTION ----------------------------------------------- #
+def export_charts(figures: dict[str, go.Figure]) -> dict[str, float]:
+    '''
+    Exports a queue of chart figures (keyed by image path) to images (see
+    `export_image`) as one batch: the image renderer is started once, kept warm
+    for every figure in the queue, and shut down afterwards. Images are only
+    written if they changed (see `write_if_changed`). Returns how long each
+    figure took, with the renderer's startup counted in "startup" rather than
+    against the first figure.
+    '''
+    timings = {}
+    start = time.perf_counter()
+    start_renderer()
+    timings["startup"] = time.perf_counter() - start
+    try:
+        for path, fig in figures.items():
+            start = time.perf_counter()
+            image = export_image(fig)
+            write_if_changed(path, image)
+            timings[path] = time.perf_counter() - start
+    finally:
+        stop_renderer()
+    return(timings)
+#endregion ------------------------------------------------------------------- #
+#region export_image FUNCTION ------------------------------------------------ #
+def export_image(fig: go.Figure) -> bytes:
+    '''
+    Exports a chart figure to an image with `CHART_BACKEND`: a PNG image at
+    `CHART_SCALE` through plotly and Kaleido, or an SVG image through the
+    built-in renderer (see `render_svg`).
+    '''
+    if CHART_BACKEND == "svg":
+        return(render_svg(fig.to_plotly_json()).encode())
+    return(pio.to_image(fig, format="png", scale=CHART_SCALE))
+#endregion ------------------------------------------------------------------- #
+#region start_renderer FUNCTION ---------------------------------------------- #
+def start_renderer() -> None:
+    '''
+    Starts the Kaleido image renderer in this process, so that it stays warm
+    for every image exported until `stop_renderer`. Kaleido 1.x runs a 
+    persistent server for this; with Kaleido 0.x, plotly keeps the renderer 
+    running once it has exported an image, so a blank figure is exported. The
+    SVG renderer needs no startup.
+    '''
+    if CHART_BACKEND != "plotly":
+        return
+    import kaleido # Only the "plotly" backend needs Kaleido, so only it loads it.
+    if hasattr(kaleido, "start_sync_server"):
+        kaleido.start_sync_server(silence_warnings=True)
+    else:
+        pio.to_image(go.Figure(), format="png")
+#endregion ------------------------------------------------------------------- #
+#region stop_renderer FUNCTION ----------------------------------------------- #
+def stop_renderer() -> None:
+    '''
+    Stops the image renderer started by `start_renderer`, if Kaleido runs it as
+    a server (Kaleido 0.x stops it when the process exits).
+    '''
+    if CHART_BACKEND != "plotly":
+        return
+    import kaleido
+    if hasattr(kaleido, "stop_sync_server"):
+        kaleido.stop_sync_server(silence_warnings=True)
+#endregion ------------------------------------------------------------------- #
+#region chart_digest FUNCTION ------------------------------------------------ #
+def chart_digest(fig: go.Figure) -> str:
+    '''
+    Gets the SHA-256 digest of everything that determines a chart image: the
+    figure JSON (data, and layout including its template), the backend, image
+    format and scale, and the plotly version (and the Kaleido version, for the
+    "plotly" backend, which renders with it).
+    '''
+    versions = [importlib.metadata.version("plotly")]
+    if CHART_BACKEND == "plotly":
+        versions.append(importlib.metadata.version("kaleido"))
+    spec = json.dumps([
+        *versions, CHART_BACKEND, CHART_FORMAT, CHART_SCALE, fig.to_plotly_json(),
+    ], sort_keys=True, cls=plotly.utils.PlotlyJSONEncoder)
+    return(hashlib.sha256(spec.encode()).hexdigest())
+#endregion ------------------------------------------------------------------- #
+#region read_chart_cache_index FUNCTION -------------------------------------- #
+def read_chart_cache_index() -> dict:
+    '''
+    Reads the index of the chart cache, which maps the digest (see 
+    `chart_digest`) of every cached image to when it was last used and how
+    many times it has been reused. Returns an empty index if `CHART_CACHE` is
+    off or the index cannot be read (e.g. it was left truncated), in which 
+    case no chart is loaded from the cache and the images are exported again.
+    '''
+    if not CHART_CACHE or not os.path.exists(f"{CHART_CACHE_DIR}/index.json"):
+        return({})
+    try:
+        with open(f"{CHART_CACHE_DIR}/index.json", "r") as input:
+            return(json.load(input))
+    except ValueError:
+        return({})
+#endregion ------------------------------------------------------------------- #
+#region load_cached_charts FUNCTION ------------------------------------------ #
+def load_cached_charts(digests: dict[str, str], cache_index: dict) -> list[str]:
+    '''
+    Writes the cached image of every chart (keyed by image path) whose digest
+    is in the chart cache. Returns the paths of those charts.
+    '''
+    cached = []
+    for path, digest in digests.items():
+        cache_file = f"{CHART_CACHE_DIR}/{digest}.{CHART_FORMAT}"
+        if digest in cache_index and os.path.exists(cache_file):
+            with open(cache_file, "rb") as input:
+                write_if_changed(path, input.read())
+            cached.append(path)
+    return(cached)
+#endregion ------------------------------------------------------------------- #
+#region write_chart_cache FUNCTION ------------------------------------------- #
+def write_chart_cache(digests: dict[str, str], cache_index: dict, 
+                      cached: list[str]) -> int:
+    '''
+    Saves the newly exported chart images to the chart cache, marks every chart
+    as just used, and evicts the least recently used images beyond 
+    `CHART_CACHE_SIZE`. Returns the number of images evicted.
+    '''
+    if not CHART_CACHE:
+        return(0)
+
+    os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+    now = time.time()
+    for path, digest in digests.items():
+        entry = cache_index.setdefault(digest, {"last_used": now, "hits": 0})
+        entry["last_used"] = now
+        if path in cached:
+            entry["hits"] += 1
+        else:
+            with open(path, "rb") as input:
+                write_if_changed(f"{CHART_CACHE_DIR}/{digest}.{CHART_FORMAT}", input.read())
+
+    # Evict the least recently used images, then any image that is no longer 
+    # in the index.
+    by_use = sorted(cache_index, key=lambda digest: cache_index[digest]["last_used"])
+    evicted = by_use[:max(len(by_use) - CHART_CACHE_SIZE, 0)]
+    for digest in evicted:
+        del cache_index[digest]
+    for file in os.listdir(CHART_CACHE_DIR):
+        if file != "index.json" and os.path.splitext(file)[0] not in cache_index:
+            os.remove(f"{CHART_CACHE_DIR}/{file}")
+
+    write_if_changed(f"{CHART_CACHE_DIR}/index.json", json.dumps(cache_index, indent=4).encode())
+    return(len(evicted))
 #endregion ------------------------------------------------------------------- #
 #region read_data FUNCTION --------------------------------------------------- #
 def read_data() -> list[dict]:
-    csv_data = {}
-    with open(f"{DIR_OUTPUT}/02_csv/annual_data.csv", "r") as input:
-        csv_reader = csv.DictReader(input)
-        for row in csv_reader:
-            if row["area_code"] != "FRD99":
-                year = row["year"]
-                area = row["area_code"]
-                if year not in csv_data:
-                    csv_data[year] = {}
-                if area not in csv_data[year]:
-                    csv_data[year][area] = defaultdict(int)
-                for field in ("annual_avg_emplvl", "avg_annual_pay"):
-                    csv_data[year][area][field] += int(row[field])
-    
+    '''
+    Reads `CHART_FIELDS` of the annual data for the twelve Federal Reserve 
+    districts and the U.S. from the data store, with their changes over each
+    of `CHANGE_LAGS` (e.g. "oty_avg_annual_pay_chg" and "_pct"), as rows 
+    sorted by year and area code. Records with zero data are left out, as on
+    the CSV file.
+    '''
+    # Lay the data out as a (year, area, field) array over consecutive years,
+    # with NaN for missing values and records with zero data.
+    arrays = load_arrays("annual")
+    areas = sorted([area for area in arrays["areas"] if area != "FRD99"])
+    area_index = [arrays["areas"].index(area) for area in areas]
+    years = np.array([int(period[0:4]) for period in arrays["periods"]], dtype=np.int64)
+    first_year = int(years.min()) if len(years) else 0
+    n_years = int(years.max()) - first_year + 1 if len(years) else 0
+    reported = np.zeros((n_years, len(areas)), dtype=bool)
+    for field in arrays["fields"]:
+        reported[years - first_year] |= np.asarray(arrays["values"][field])[:, area_index] > 0
+    values = np.full((n_years, len(areas), len(CHART_FIELDS)), np.nan)
+    for f, field in enumerate(CHART_FIELDS):
+        array = np.asarray(arrays["values"][field])[:, area_index]
+        values[years - first_year, :, f] = np.where(array == NULL_VALUE, np.nan, array)
+    values[~reported] = np.nan
+
+    # Get the changes over each lag.
+    changes = get_changes(values, list(CHANGE_LAGS.values()))
+    values = values.tolist()
+    changes = {lag: (chg.tolist(), pct.tolist()) for lag, (chg, pct) in changes.items()}
+
+    # Convert the arrays into rows.
     longitudinal_data = []
-    for year, area_codes in csv_data.items():
-        prior_year = f"{int(year)-1}"
-        prior_decade = f"{int(year)-10}"
-        for area_code, fields in area_codes.items():
-            area_title = "Total U.S." if area_code == "USDPV" else FRD_TITLES[area_code]
+    for y in range(n_years):
+        for a, area_code in enumerate(areas):
+            if not reported[y, a]:
+                continue
             csv_row = {
-                "year": year,
-                "area_title": area_title,
+                "year": str(first_year + y),
+                "area_title": "Total U.S." if area_code == "USDPV" else FRD_TITLES[area_code],
             }
-            for field, value in fields.items():
-                csv_row[field] = value
-                # Get the over-the-year and over-the-decade changes.
-                for prior_period in (prior_year, prior_decade):
-                    t = "y" if prior_period == prior_year else "d"
-                    if prior_period in csv_data.keys():
-                        prior_values = csv_data[prior_period][area_code]
-                        for field, prior_value in prior_values.items():
-                            value = fields[field]
-                            if value is not None and prior_value is not None:
-                                delta = value - prior_value
-                            else:
-                                delta = None
-                            csv_row[f"ot{t}_{field}_chg"] = delta
-                            if delta is not None and prior_value > 0:
-                                csv_row[f"ot{t}_{field}_pct"] = round(delta/prior_value*100, 1)
-                            else:
-                                csv_row[f"ot{t}_{field}_pct"] = None
-                    else:
-                        for field, value in fields.items():
-                            csv_row[f"ot{t}_{field}_chg"] = None
-                            csv_row[f"ot{t}_{field}_pct"] = None
+            for f, field in enumerate(CHART_FIELDS):
+                value = values[y][a][f]
+                csv_row[field] = None if value != value else int(value)
+            for t, lag in CHANGE_LAGS.items():
+                chg, pct = changes[lag]
+                for f, field in enumerate(CHART_FIELDS):
+                    delta, percent = chg[y][a][f], pct[y][a][f]
+                    csv_row[f"{t}_{field}_chg"] = None if delta != delta else int(delta)
+                    csv_row[f"{t}_{field}_pct"] = None if percent != percent else round(percent, 1)
             longitudinal_data.append(csv_row)
-    
-    longitudinal_data = sorted(longitudinal_data, key=lambda d: d["year"])
 
     return(longitudinal_data)
 #endregion ------------------------------------------------------------------- #
+#region get_changes FUNCTION ------------------------------------------------- #
+def get_changes(values: np.ndarray, lags: list[int]) -> dict:
+    '''
+    Gets the changes in a (year, area, field) array of values for consecutive
+    years over each lag (in years), with whole-array operations. Returns 
+    (change, percent change) arrays of the same shape for each lag. Changes 
+    are NaN where either value is missing (NaN), and percent changes also where
+    the earlier value is not positive. Percent changes are not rounded.
+    '''
+    changes = {}
+    for lag in lags:
+        prior = np.full_like(values, np.nan, dtype=np.float64)
+        if 0 < lag < len(values):
+            prior[lag:] = values[:len(values) - lag]
+        chg = values - prior
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct = np.where(prior > 0, chg/prior*100, np.nan)
+        changes[lag] = (chg, pct)
+    return(changes)
+#endregion ------------------------------------------------------------------- #
 #region generate_pie_chart FUNCTION ------------------------------------------ #
-def generate_pie_chart(data: list[dict], ref_year: str) -> None:
+def generate_pie_chart(data: list[dict], ref_year: str) -> go.Figure:
     
     chart_data = [d for d in data if d["area_title"] != "Total U.S."]
     
@@ -180,10 +403,10 @@ def generate_pie_chart(data: list[dict], ref_year: str) -> None:
         text="Source: Author's (github@TrentLThompson) calculations based on data from the U.S. Bureau of Labor Statistics."
     )
 
-    fig.write_image(f"{DIR_OUTPUT}/03_charts/pie_annual_avg_emplvl.png", scale=6)
+    return(fig)
 #endregion ------------------------------------------------------------------- #
 #region generate_bar_chart FUNCTION ------------------------------------------ #
-def generate_bar_chart(data: list[dict], ref_year: str, field: str) -> None:
+def generate_bar_chart(data: list[dict], ref_year: str, field: str) -> go.Figure:
 
     chart_data = []
     for dict in data:
@@ -283,10 +506,10 @@ def generate_bar_chart(data: list[dict], ref_year: str, field: str) -> None:
         text="Source: Author's (github@TrentLThompson) calculations based on data from the U.S. Bureau of Labor Statistics."
     )
 
-    fig.write_image(f"{DIR_OUTPUT}/03_charts/bar_{field}.png", scale=6)
+    return(fig)
 #endregion ------------------------------------------------------------------- #
 #region generate_line_chart FUNCTION ----------------------------------------- #
-def generate_line_chart(data: list[dict], ref_year: str, field: str) -> None:
+def generate_line_chart(data: list[dict], ref_year: str, field: str) -> go.Figure:
 
     index_year = str(int(ref_year) - 10) # Index year = same year as reference year minus ten years.
 
@@ -377,7 +600,7 @@ def generate_line_chart(data: list[dict], ref_year: str, field: str) -> None:
         text="Source: Author's (github@TrentLThompson) calculations based on data from the U.S. Bureau of Labor Statistics."
     )
 
-    fig.write_image(f"{DIR_OUTPUT}/03_charts/line_{field}.png", scale=6)
+    return(fig)
 #endregion ------------------------------------------------------------------- #
 #region write_markdown FUNCTION ---------------------------------------------- #
 def write_markdown(data: list[dict], ref_year: str) -> None:
@@ -397,11 +620,10 @@ def write_markdown(data: list[dict], ref_year: str) -> None:
     p1 = f"According to data from the Bureau of Labor Statistics' Quarterly Census of Employment and Wages ([QCEW](https://www.bls.gov/cew/)), the {largest_district} Federal Reserve district had the largest share of U.S. annual average employment ({largest_district_shr}%) in {ref_year}, while the {smallest_district} Federal Reserve district had the smallest share ({smallest_district_shr}%).\n\n"
 
     markdown = ""
-    markdown += f"Last updated: {datetime.date.today().strftime('%B %d, %Y')}\n\n"
     markdown += f"# Federal Reserve District Employment & Wages\n\n"
     markdown += f"[Just give me the data!](https://github.com/TrentLThompson/federal-reserve-qcew/tree/main/03_outputs/02_csv)\n\n"
     markdown += p1
-    markdown += f"![](03_outputs/03_charts/pie_annual_avg_emplvl.png)\n\n"
+    markdown += f"![](03_outputs/03_charts/pie_annual_avg_emplvl.{CHART_FORMAT})\n\n"
     
     for time_frame in ("oty", "otd"):
         for field in ("annual_avg_emplvl", "avg_annual_pay"):
@@ -418,12 +640,21 @@ def write_markdown(data: list[dict], ref_year: str) -> None:
             markdown += f"From {prior_year} to {ref_year}, {field_title} {focus}d in {n_focus} of the twelve Federal Reserve districts. The {top_district_title} Federal Reserve district had the largest over-the-{timespan} percentage {focus} in {field_title} ({top_district_pct} percent).\n\n"
             
             chart_ref = f"line_{field}" if time_frame == "otd" else f"bar_oty_{field}_pct"
-            markdown += f"![](03_outputs/03_charts/{chart_ref}.png)\n\n"
+            markdown += f"![](03_outputs/03_charts/{chart_ref}.{CHART_FORMAT})\n\n"
     
-    markdown += f"<br>Last updated: {datetime.date.today().strftime('%B %d, %Y')}"
-
-    with open(f"{DIR_ROOT}/README.md", "w") as output:
-        output.write(markdown)
+    # Date the markdown. If nothing but the date has changed since the README
+    # was last written, keep its date, so that it is only rewritten when its
+    # content changes.
+    today = datetime.date.today().strftime('%B %d, %Y')
+    readme = f"Last updated: {today}\n\n{markdown}<br>Last updated: {today}"
+    if os.path.exists(f"{DIR_ROOT}/README.md"):
+        with open(f"{DIR_ROOT}/README.md", "r") as input:
+            existing = input.read()
+        date = existing.split("\n", 1)[0].removeprefix("Last updated: ")
+        if existing == f"Last updated: {date}\n\n{markdown}<br>Last updated: {date}":
+            readme = existing
+
+    write_if_changed(f"{DIR_ROOT}/README.md", readme.encode())
 #endregion ------------------------------------------------------------------- #
 ################################################################################
 #endregion
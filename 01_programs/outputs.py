@@ -0,0 +1,110 @@
+################################################################################
+#region IMPORTS
+################################################################################
+from contextlib import contextmanager
+from typing import Iterator, TextIO
+import hashlib, os, tempfile
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region CONSTANTS
+################################################################################
+UMASK = os.umask(0) # File mode creation mask, for the permissions of temporary files.
+os.umask(UMASK) # Reading the mask sets it, so it is restored.
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region FUNCTIONS
+################################################################################
+#region write_if_changed FUNCTION -------------------------------------------- #
+def write_if_changed(path: str, content: bytes) -> bool:
+    '''
+    Writes content rendered in memory to a file, unless the file already holds
+    the same content (same size and SHA-256 digest), in which case the file
+    and its modification time are left alone. Writes are atomic: the content
+    goes to a temporary file that then replaces the file. Returns whether the
+    file was written.
+    '''
+    if (
+        os.path.exists(path)
+        and os.path.getsize(path) == len(content)
+        and file_digest(path) == hashlib.sha256(content).hexdigest()
+    ):
+        return(False)
+
+    temp_path = make_temp_file(path)
+    try:
+        with open(temp_path, "wb") as output:
+            output.write(content)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+    return(True)
+#endregion ------------------------------------------------------------------- #
+#region open_if_changed FUNCTION --------------------------------------------- #
+@contextmanager
+def open_if_changed(path: str) -> Iterator[TextIO]:
+    '''
+    Streaming version of `write_if_changed`, for text that is better written
+    out as it is produced than rendered in memory first. Yields a temporary
+    file to write to; once it is closed, it replaces the file unless both have
+    the same size and SHA-256 digest, in which case it is deleted. If writing
+    fails, the file is left as it was.
+    '''
+    temp_path = make_temp_file(path)
+    try:
+        with open(temp_path, "w") as output:
+            yield output
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    if (
+        os.path.exists(path)
+        and os.path.getsize(path) == os.path.getsize(temp_path)
+        and file_digest(path) == file_digest(temp_path)
+    ):
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, path)
+#endregion ------------------------------------------------------------------- #
+#region make_temp_file FUNCTION ---------------------------------------------- #
+def make_temp_file(path: str) -> str:
+    '''
+    Creates a uniquely named temporary file in the same directory as a file, 
+    so that it can replace the file atomically and processes writing the same
+    file at once never share one. The temporary file gets the permissions of
+    a newly created file. Returns its path.
+    '''
+    handle, temp_path = tempfile.mkstemp(
+        prefix=f"{os.path.basename(path)}.",
+        suffix=".tmp",
+        dir=os.path.dirname(path) or "."
+    )
+    os.close(handle)
+    os.chmod(temp_path, 0o666 & ~UMASK)
+    return(temp_path)
+#endregion ------------------------------------------------------------------- #
+#region file_digest FUNCTION ------------------------------------------------- #
+def file_digest(path: str) -> str:
+    '''
+    Gets the SHA-256 digest of a file, reading it in 1 MiB chunks.
+    '''
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as input:
+        for chunk in iter(lambda: input.read(1 << 20), b""):
+            sha256.update(chunk)
+    return(sha256.hexdigest())
+#endregion ------------------------------------------------------------------- #
+################################################################################
+#endregion
+################################################################################
@@ -0,0 +1,291 @@
+################################################################################
+#region IMPORTS
+################################################################################
+from config import *
+from outputs import write_if_changed
+from collections.abc import MutableMapping
+from typing import Iterator
+import io, json, os
+try:
+    import numpy as np
+except ImportError:
+    np = None
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region CONSTANTS
+################################################################################
+NULL_VALUE = -2**63 # Stands in for `None` (e.g. no average wage) in store arrays.
+USE_STORE = NPY_STORE and np is not None # Without NumPy, the JSON files stay the working format.
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region CLASSES
+################################################################################
+#region StoredData CLASS ----------------------------------------------------- #
+class StoredData(MutableMapping):
+    '''
+    A dataset opened from the binary store, used in place of the dictionary of
+    periods, areas, and fields that `load_data` otherwise returns. A period is
+    read from the memory-mapped arrays only when it is looked up, so stages 
+    that use a few periods (the API update, and the patches to the annual and 
+    rolling data) do not read the rest of the history. Periods that are set 
+    are held in memory until the dataset is saved; setting a period to the 
+    data it already has is not a change. Periods read from the store come back
+    as new dictionaries, so a period is changed by setting it.
+    '''
+    def __init__(self, store: dict) -> None:
+        self.reset(store)
+    
+    def reset(self, store: dict) -> None:
+        '''
+        Points the dataset at a store (or at arrays in the same form), with no
+        changes.
+        '''
+        self.store = store
+        self.rows = {period: p for p, period in enumerate(store["periods"])}
+        self.periods = list(store["periods"])
+        self.changes = {}
+        self.changed = False
+    
+    def __getitem__(self, period: str) -> dict:
+        if period in self.changes:
+            return(self.changes[period])
+        p = self.rows[period]
+        values = {field: array[p].tolist() for field, array in self.store["values"].items()}
+        return({
+            area: {
+                field: None if values[field][a] == NULL_VALUE else values[field][a]
+                for field in self.store["fields"]
+            }
+            for a, area in enumerate(self.store["areas"])
+        })
+    
+    def __setitem__(self, period: str, areas: dict) -> None:
+        if period in self and self[period] == areas:
+            return
+        if period not in self:
+            self.periods.append(period)
+        self.changes[period] = areas
+        self.changed = True
+    
+    def __delitem__(self, period: str) -> None:
+        if period not in self:
+            raise KeyError(period)
+        self.periods.remove(period)
+        self.rows.pop(period, None)
+        self.changes.pop(period, None)
+        self.changed = True
+    
+    def __contains__(self, period: str) -> bool:
+        return(period in self.changes or period in self.rows)
+    
+    def __iter__(self) -> Iterator[str]:
+        return(iter(list(self.periods)))
+    
+    def __len__(self) -> int:
+        return(len(self.periods))
+#endregion ------------------------------------------------------------------- #
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region FUNCTIONS
+################################################################################
+#region load_data FUNCTION --------------------------------------------------- #
+def load_data(name: str) -> dict:
+    '''
+    Loads the "quarterly", "annual", or "rolling" dataset as a dictionary of 
+    periods, areas, and fields. When `NPY_STORE` is on and the binary store is
+    up to date with the exported JSON file, the dataset is opened from the 
+    store (see `StoredData`) and only the periods that are looked up are read,
+    so loading takes the same time however long the history is. Otherwise the
+    JSON file is read (and the store rebuilt from it).
+    '''
+    json_path = f"{DIR_OUTPUT}/01_json/{name}_data.json"
+    if USE_STORE:
+        store = read_store(name)
+        if store is not None and store["json"] == stat_file(json_path):
+            return(StoredData(store))
+
+    with open(json_path, "r") as input:
+        data = json.load(input)
+    if USE_STORE:
+        write_store(name, data_to_arrays(data), stat_file(json_path))
+    return(data)
+#endregion ------------------------------------------------------------------- #
+#region save_data FUNCTION --------------------------------------------------- #
+def save_data(name: str, data: dict) -> None:
+    '''
+    Saves the "quarterly", "annual", or "rolling" dataset: exports the pretty
+    JSON file and, when `NPY_STORE` is on, writes the binary store. A dataset
+    opened from the store that has not changed is not saved at all, and files
+    whose content has not changed are not rewritten (see `write_if_changed`).
+    '''
+    if isinstance(data, StoredData) and not data.changed:
+        return
+    
+    # Lay the dataset out as arrays. A dataset opened from the store then 
+    # works from these arrays, which releases its memory-mapped files before
+    # they are replaced.
+    arrays = data_to_arrays(data) if USE_STORE else None
+    if isinstance(data, StoredData):
+        data.reset(arrays)
+        data = arrays_to_data(arrays)
+    
+    # Export the JSON file, then write the store.
+    json_path = f"{DIR_OUTPUT}/01_json/{name}_data.json"
+    write_if_changed(json_path, json.dumps(data, indent=4).encode())
+    if USE_STORE:
+        write_store(name, arrays, stat_file(json_path))
+#endregion ------------------------------------------------------------------- #
+#region sort_periods FUNCTION ------------------------------------------------ #
+def sort_periods(data: dict) -> None:
+    '''
+    Puts the periods of a dataset in order, in place. The periods of a dataset
+    opened from the store are reordered without reading them.
+    '''
+    periods = sorted(data.keys())
+    if list(data.keys()) == periods:
+        return
+    if isinstance(data, StoredData):
+        data.periods = periods
+        data.changed = True
+    else:
+        for period in periods:
+            data[period] = data.pop(period)
+#endregion ------------------------------------------------------------------- #
+#region load_arrays FUNCTION ------------------------------------------------- #
+def load_arrays(name: str) -> dict:
+    '''
+    Loads the "quarterly", "annual", or "rolling" dataset as arrays: its 
+    periods, areas, and fields, with one (period, area) int64 array per field
+    under "values" (`NULL_VALUE` for `None`). Opens the binary store directly 
+    when it is up to date with the exported JSON file; otherwise converts the 
+    data from `load_data`.
+    '''
+    if np is None:
+        raise ImportError("load_arrays requires NumPy.")
+    json_path = f"{DIR_OUTPUT}/01_json/{name}_data.json"
+    if USE_STORE:
+        store = read_store(name)
+        if store is not None and store["json"] == stat_file(json_path):
+            return(store)
+    return(data_to_arrays(load_data(name)))
+#endregion ------------------------------------------------------------------- #
+#region read_store FUNCTION -------------------------------------------------- #
+def read_store(name: str) -> dict:
+    '''
+    Opens a dataset in the binary store (`DIR_STORE`). Returns its index
+    (periods, areas, fields, and the exported JSON file it matches) with one
+    memory-mapped (period, area) int64 array per field under "values", or
+    `None` if the dataset is not in the store. Only the index is read up front.
+    '''
+    if not os.path.exists(f"{DIR_STORE}/{name}/index.json"):
+        return(None)
+    with open(f"{DIR_STORE}/{name}/index.json", "r") as input:
+        store = json.load(input)
+    store["values"] = {
+        field: np.load(f"{DIR_STORE}/{name}/{field}.npy", mmap_mode="r")
+        for field in store["fields"]
+    }
+    return(store)
+#endregion ------------------------------------------------------------------- #
+#region write_store FUNCTION ------------------------------------------------- #
+def write_store(name: str, arrays: dict, json_stat: dict) -> None:
+    '''
+    Writes a dataset laid out as arrays (see `data_to_arrays`) to the binary 
+    store (`DIR_STORE`), as one .npy file per field and an index.
+    '''
+    os.makedirs(f"{DIR_STORE}/{name}", exist_ok=True)
+    for field, array in arrays["values"].items():
+        buffer = io.BytesIO()
+        np.save(buffer, array)
+        write_if_changed(f"{DIR_STORE}/{name}/{field}.npy", buffer.getvalue())
+
+    # The index is written last, so a store is only used once all of its arrays
+    # have been written.
+    store = {k: arrays[k] for k in ("periods", "areas", "fields")}
+    store["json"] = json_stat
+    write_if_changed(f"{DIR_STORE}/{name}/index.json", json.dumps(store).encode())
+#endregion ------------------------------------------------------------------- #
+#region data_to_arrays FUNCTION ---------------------------------------------- #
+def data_to_arrays(data: dict) -> dict:
+    '''
+    Converts a dictionary of periods, areas, and fields into arrays, in the
+    form returned by `read_store`. Every period must have the same areas and
+    every area the same fields, as the datasets do. `None` values become 
+    `NULL_VALUE`. The periods of a dataset opened from the store that have not
+    changed are copied straight from its arrays.
+    '''
+    periods = list(data.keys())
+    if isinstance(data, StoredData) and data.store["periods"]:
+        areas, fields = data.store["areas"], data.store["fields"]
+    else:
+        areas = list(data[periods[0]].keys()) if periods else []
+        fields = list(data[periods[0]][areas[0]].keys()) if areas else []
+    
+    # Split the periods into those copied from the store and those converted
+    # from dictionaries.
+    stored, converted = [], []
+    for p, period in enumerate(periods):
+        if isinstance(data, StoredData) and period not in data.changes:
+            stored.append(p)
+        else:
+            converted.append(p)
+    rows = [data.rows[periods[p]] for p in stored]
+    
+    values = {}
+    for field in fields:
+        values[field] = np.empty((len(periods), len(areas)), dtype=np.int64)
+        if stored:
+            values[field][stored] = data.store["values"][field][rows]
+        if converted:
+            values[field][converted] = [
+                [NULL_VALUE if data[periods[p]][a][field] is None else data[periods[p]][a][field] for a in areas]
+                for p in converted
+            ]
+    return({"periods": periods, "areas": areas, "fields": fields, "values": values})
+#endregion ------------------------------------------------------------------- #
+#region arrays_to_data FUNCTION ---------------------------------------------- #
+def arrays_to_data(arrays: dict) -> dict:
+    '''
+    Converts a dataset laid out as arrays (see `data_to_arrays`) back into a 
+    dictionary of periods, areas, and fields.
+    '''
+    values = {
+        field: [[None if v == NULL_VALUE else v for v in row] for row in array.tolist()]
+        for field, array in arrays["values"].items()
+    }
+    data = {}
+    for p, period in enumerate(arrays["periods"]):
+        data[period] = {}
+        for a, area in enumerate(arrays["areas"]):
+            data[period][area] = {field: values[field][p][a] for field in arrays["fields"]}
+    return(data)
+#endregion ------------------------------------------------------------------- #
+#region stat_file FUNCTION --------------------------------------------------- #
+def stat_file(path: str) -> dict:
+    '''
+    Gets the size and modification time of a file (`None` if it does not
+    exist), used to tell whether the store still matches the exported JSON.
+    '''
+    if not os.path.exists(path):
+        return(None)
+    stat = os.stat(path)
+    return({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+#endregion ------------------------------------------------------------------- #
+################################################################################
+#endregion
+################################################################################
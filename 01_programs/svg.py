@@ -0,0 +1,802 @@
+################################################################################
+#region IMPORTS
+################################################################################
+from xml.sax.saxutils import escape
+import math, re
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region CONSTANTS
+################################################################################
+SVG_WIDTH = 700 # Image width when the figure does not set one, as in plotly.
+SVG_HEIGHT = 500 # Image height when the figure does not set one, as in plotly.
+SVG_MARGIN = {"l": 80, "r": 80, "t": 100, "b": 80} # Plot margins the figure does not set, as in plotly.
+SVG_FONT = {"family": "sans-serif", "size": 12, "color": "#444"} # Font settings neither the figure nor its template set.
+CHAR_WIDTH = 0.6 # Approximate width of a character, as a fraction of the font size.
+LEGEND_ROW = 19 # Height of a legend entry, in pixels.
+DASH_PATTERNS = { # Line dash styles, in line widths (of at least 3 px), as in plotly.js.
+    "solid": [],
+    "dot": [1, 1],
+    "dash": [3, 3],
+    "longdash": [5, 5],
+    "dashdot": [3, 1, 1, 1],
+    "longdashdot": [5, 2, 1, 2],
+}
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region FUNCTIONS
+################################################################################
+#region render_svg FUNCTION -------------------------------------------------- #
+def render_svg(fig: dict) -> str:
+    '''
+    Renders a chart figure (as from `go.Figure.to_plotly_json`) to an SVG image
+    in pure Python, without the headless browser plotly exports images with.
+    Covers what the charts in markdown.py use: pie (donut) traces, horizontal
+    or vertical bar traces, line traces, reference line shapes, annotations, a
+    title, and a legend. Colors and dash styles are the figure's own, with the
+    figure's template filling in any layout settings the figure leaves unset.
+    '''
+    # Resolve the layout against the template, and get the figure size, font,
+    # and traces.
+    layout = merge_layout(fig["layout"].get("template", {}).get("layout", {}), fig["layout"])
+    width = layout.get("width", SVG_WIDTH)
+    height = layout.get("height", SVG_HEIGHT)
+    font = {**SVG_FONT, **layout.get("font", {})}
+    traces = [{key: as_list(value) for key, value in trace.items()} for trace in fig["data"]]
+    is_pie = any(trace.get("type") == "pie" for trace in traces)
+
+    # Get the axes, the legend, and the plot area they leave.
+    axes = {} if is_pie else {
+        letter: build_axis(traces, layout, letter) for letter in ("x", "y")
+    }
+    legend = build_legend(traces, layout, font)
+    area = plot_area(layout, width, height, axes, legend, font)
+
+    # Draw the background, the traces, the shapes, the annotations, the legend,
+    # and the title, in that order.
+    elements = [
+        f'<rect width="{width}" height="{height}" '
+        f'fill="{layout.get("paper_bgcolor", "white")}"/>'
+    ]
+    if is_pie:
+        for trace in traces:
+            elements += draw_pie(trace, layout, area, font)
+    else:
+        elements += draw_cartesian(traces, layout, area, axes, font)
+        elements += draw_shapes(layout, area, axes)
+    elements += draw_annotations(layout, area, axes, font)
+    elements += draw_legend(legend, area, font)
+    elements += draw_title(layout, width, height, font)
+
+    family = escape(font["family"], {'"': "&quot;"})
+    return(
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="{family}">\n'
+        f'<defs><clipPath id="plot"><rect x="{num(area["x0"])}" y="{num(area["y0"])}" '
+        f'width="{num(area["x1"] - area["x0"])}" height="{num(area["y1"] - area["y0"])}"/>'
+        f'</clipPath></defs>\n'
+        + "\n".join(elements)
+        + "\n</svg>\n"
+    )
+#endregion ------------------------------------------------------------------- #
+#region merge_layout FUNCTION ------------------------------------------------ #
+def merge_layout(defaults: dict, layout: dict) -> dict:
+    '''
+    Merges layout settings into defaults (e.g. a template's layout), nested
+    settings included.
+    '''
+    merged = dict(defaults)
+    for key, value in layout.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_layout(merged[key], value)
+        else:
+            merged[key] = value
+    return(merged)
+#endregion ------------------------------------------------------------------- #
+#region build_axis FUNCTION -------------------------------------------------- #
+def build_axis(traces: list[dict], layout: dict, letter: str) -> dict:
+    '''
+    Works out the type and range of the x or y axis from its layout settings
+    and the values the traces plot on it. An axis is a "category" axis if any
+    value is not a number, like plotly's automatic axis type; otherwise it is a
+    "linear" axis.
+    '''
+    settings = layout.get(f"{letter}axis", {})
+    values = [value for trace in traces for value in trace.get(letter, [])]
+    axis = {"letter": letter, "settings": settings}
+
+    # Category axes: one unit per category, in the order `categoryorder` asks
+    # for.
+    if not all(is_number(value) for value in values):
+        categories = list(dict.fromkeys(values))
+        order = settings.get("categoryorder", "trace")
+        if order.startswith("total"):
+            other = "y" if letter == "x" else "x"
+            totals = {category: 0 for category in categories}
+            for trace in traces:
+                for category, value in zip(trace.get(letter, []), trace.get(other, [])):
+                    totals[category] += float(value)
+            categories.sort(key=lambda category: totals[category], reverse=order.endswith("descending"))
+        elif order == "array":
+            array = settings.get("categoryarray", [])
+            categories.sort(key=lambda category: array.index(category) if category in array else len(array))
+        axis["type"] = "category"
+        axis["categories"] = categories
+        axis["range"] = [-0.5, len(categories) - 0.5]
+        return(axis)
+
+    # Linear axes: the set range, or the range of the values, from zero for
+    # bar lengths and padded for line values.
+    axis["type"] = "linear"
+    if "range" in settings:
+        axis["range"] = [float(bound) for bound in settings["range"]]
+        return(axis)
+    numbers = [float(value) for value in values] or [0.0, 1.0]
+    low, high = min(numbers), max(numbers)
+    bars = any(
+        trace.get("type") == "bar" and bar_axes(trace)[1] == letter for trace in traces
+    )
+    if bars:
+        low, high = min(low, 0.0), max(high, 0.0)
+    elif letter == "y":
+        padding = (high - low)*0.05 or 1.0
+        low, high = low - padding, high + padding
+    if low == high:
+        low, high = low - 1.0, high + 1.0
+    axis["range"] = [low, high]
+    return(axis)
+#endregion ------------------------------------------------------------------- #
+#region build_legend FUNCTION ------------------------------------------------ #
+def build_legend(traces: list[dict], layout: dict, font: dict) -> dict:
+    '''
+    Gets the legend entries (one per pie slice, or one per named trace) with
+    their color and line dash, and the size of the legend box. Returns `None`
+    if the figure shows no legend.
+    '''
+    entries = []
+    for trace in traces:
+        if trace.get("type") == "pie":
+            colors = trace.get("marker", {}).get("colors") or layout.get("colorway", ["#444"])
+            for i, label in enumerate(trace.get("labels", [])):
+                entries.append({"name": str(label), "color": colors[i % len(colors)], "type": "pie"})
+        elif trace.get("showlegend", True) and trace.get("name"):
+            entries.append({
+                "name": str(trace["name"]),
+                "color": trace_color(trace),
+                "dash": trace.get("line", {}).get("dash", "solid"),
+                "type": trace.get("type", "scatter"),
+            })
+    if not entries or not layout.get("showlegend", True):
+        return(None)
+
+    settings = layout.get("legend", {})
+    title = settings.get("title", {}).get("text")
+    rows = len(entries) + (1 if title else 0)
+    names = [entry["name"] for entry in entries] + ([title] if title else [])
+    return({
+        "entries": entries,
+        "title": title,
+        "settings": settings,
+        "width": 50 + max(text_width(name, font["size"]) for name in names),
+        "height": rows*LEGEND_ROW + 6,
+    })
+#endregion ------------------------------------------------------------------- #
+#region plot_area FUNCTION --------------------------------------------------- #
+def plot_area(layout: dict, width: int, height: int, axes: dict, legend: dict,
+              font: dict) -> dict:
+    '''
+    Gets the pixel bounds of the plot area: the figure less its margins, with
+    the margins widened (like plotly's automatic margins) to fit category
+    labels and a legend placed outside the plot area.
+    '''
+    margin = {**SVG_MARGIN, **layout.get("margin", {})}
+
+    # Widen the margin on the side of a category axis's labels to fit them.
+    y_axis = axes.get("y")
+    if y_axis is not None and y_axis["type"] == "category":
+        size = y_axis["settings"].get("tickfont", {}).get("size", font["size"])
+        labels = max(text_width(str(category), size) for category in y_axis["categories"]) + 12
+        side = "r" if y_axis["settings"].get("side") == "right" else "l"
+        margin[side] = max(margin[side], labels)
+
+    x0, y0 = margin["l"], margin["t"]
+    x1, y1 = width - margin["r"], height - margin["b"]
+
+    # Narrow the plot area so that a legend to its right fits in the figure.
+    if legend is not None:
+        legend_x = legend["settings"].get("x", 1.02)
+        if legend_x >= 1:
+            x1 = min(x1, x0 + (width - 5 - legend["width"] - x0)/legend_x)
+    return({"x0": x0, "y0": y0, "x1": x1, "y1": y1})
+#endregion ------------------------------------------------------------------- #
+#region draw_pie FUNCTION ---------------------------------------------------- #
+def draw_pie(trace: dict, layout: dict, area: dict, font: dict) -> list[str]:
+    '''
+    Draws a pie trace, with a hole in the middle if it has one, and labels each
+    slice with its `texttemplate` (the percent by default).
+    '''
+    labels = trace.get("labels", [])
+    values = [float(value) for value in trace.get("values", [])]
+    colors = trace.get("marker", {}).get("colors") or layout.get("colorway", ["#444"])
+    total = sum(values)
+    if total <= 0:
+        return([])
+
+    # Get the slice order, the center and radii, and the direction.
+    order = list(range(len(values)))
+    if trace.get("sort", True):
+        order.sort(key=lambda i: values[i], reverse=True)
+    domain = trace.get("domain", {})
+    dx, dy = domain.get("x", [0, 1]), domain.get("y", [0, 1])
+    left = area["x0"] + dx[0]*(area["x1"] - area["x0"])
+    right = area["x0"] + dx[1]*(area["x1"] - area["x0"])
+    top = area["y1"] - dy[1]*(area["y1"] - area["y0"])
+    bottom = area["y1"] - dy[0]*(area["y1"] - area["y0"])
+    cx, cy = (left + right)/2, (top + bottom)/2
+    outer = min(right - left, bottom - top)/2
+    inner = outer*trace.get("hole", 0)
+    sign = 1 if trace.get("direction", "counterclockwise") == "clockwise" else -1
+
+    # Draw each slice from 12 o'clock (plus any rotation), then its label at
+    # the middle of the slice.
+    elements, labels_elements = [], []
+    angle = math.radians(trace.get("rotation", 0))
+    for i in order:
+        fraction = values[i]/total
+        end = angle + sign*2*math.pi*fraction
+        color = colors[i % len(colors)]
+        elements.append(
+            f'<path d="{slice_path(cx, cy, outer, inner, angle, end)}" fill="{color}"/>'
+        )
+        if fraction > 0:
+            middle = (angle + end)/2
+            radius = (outer + inner)/2
+            text = format_template(
+                trace.get("texttemplate", "%{percent:.1%}"),
+                {"label": labels[i], "value": values[i], "percent": fraction},
+            )
+            space = 2*radius*math.sin(min(math.pi*fraction, math.pi/2))
+            size = min(font["size"], space/max(len(text)*CHAR_WIDTH, 1))
+            labels_elements.append(svg_text(
+                cx + radius*math.sin(middle), cy - radius*math.cos(middle), text,
+                size, contrast_color(color), "middle", "middle",
+            ))
+        angle = end
+    return(elements + labels_elements)
+#endregion ------------------------------------------------------------------- #
+#region slice_path FUNCTION -------------------------------------------------- #
+def slice_path(cx: float, cy: float, outer: float, inner: float, start: float,
+               end: float) -> str:
+    '''
+    Gets the SVG path of a pie slice between two angles (in radians clockwise
+    from 12 o'clock), as a ring segment if `inner` is not zero.
+    '''
+    # A whole pie is drawn as two half slices, since an arc cannot close.
+    if abs(end - start) >= 2*math.pi - 1e-9:
+        middle = (start + end)/2
+        return(
+            slice_path(cx, cy, outer, inner, start, middle) + " "
+            + slice_path(cx, cy, outer, inner, middle, end)
+        )
+
+    point = lambda radius, angle: (
+        f"{num(cx + radius*math.sin(angle))},{num(cy - radius*math.cos(angle))}"
+    )
+    large = 1 if abs(end - start) > math.pi else 0
+    sweep = 1 if end > start else 0
+    path = f"M{point(outer, start)} A{num(outer)},{num(outer)} 0 {large} {sweep} {point(outer, end)}"
+    if inner > 0:
+        path += f" L{point(inner, end)} A{num(inner)},{num(inner)} 0 {large} {1 - sweep} {point(inner, start)}"
+    else:
+        path += f" L{num(cx)},{num(cy)}"
+    return(path + " Z")
+#endregion ------------------------------------------------------------------- #
+#region draw_cartesian FUNCTION ---------------------------------------------- #
+def draw_cartesian(traces: list[dict], layout: dict, area: dict, axes: dict,
+                   font: dict) -> list[str]:
+    '''
+    Draws the plot background, the gridlines and zero lines, the bar and line
+    traces (clipped to the plot area), and then the axis lines and tick labels.
+    '''
+    elements = [
+        f'<rect x="{num(area["x0"])}" y="{num(area["y0"])}" '
+        f'width="{num(area["x1"] - area["x0"])}" height="{num(area["y1"] - area["y0"])}" '
+        f'fill="{layout.get("plot_bgcolor", "white")}"/>'
+    ]
+
+    # Get the ticks of each axis, and draw the gridlines and zero lines.
+    for axis in axes.values():
+        axis["ticks"] = axis_ticks(axis, area)
+    for axis in axes.values():
+        settings = axis["settings"]
+        if settings.get("showgrid", True):
+            for value, label in axis["ticks"]:
+                elements.append(axis_line(
+                    axis, area, value, settings.get("gridcolor", "#eee"),
+                    settings.get("gridwidth", 1),
+                ))
+        low, high = axis["range"]
+        if axis["type"] == "linear" and settings.get("zeroline", True) and min(low, high) <= 0 <= max(low, high):
+            elements.append(axis_line(
+                axis, area, 0, settings.get("zerolinecolor", "#444"),
+                settings.get("zerolinewidth", 1),
+            ))
+
+    # Draw the traces.
+    elements.append('<g clip-path="url(#plot)">')
+    labels = []
+    for trace in traces:
+        if trace.get("type") == "bar":
+            bars, bar_labels = draw_bars(trace, layout, area, axes, font)
+            elements += bars
+            labels += bar_labels
+        elif trace.get("type", "scatter") == "scatter":
+            elements += draw_lines(trace, area, axes)
+    elements.append("</g>")
+    elements += labels
+
+    # Draw the axis lines (on both sides if mirrored) and the tick labels.
+    for axis in axes.values():
+        elements += draw_axis(axis, area, font)
+    return(elements)
+#endregion ------------------------------------------------------------------- #
+#region axis_ticks FUNCTION -------------------------------------------------- #
+def axis_ticks(axis: dict, area: dict) -> list[tuple]:
+    '''
+    Gets the ticks (value and label) of an axis: every category of a category
+    axis, or multiples of `dtick` from `tick0` across the range of a linear
+    axis, with `dtick` a "nice" step giving about one tick per 80 pixels (x) or
+    40 pixels (y) if it is not set.
+    '''
+    settings = axis["settings"]
+    if axis["type"] == "category":
+        return([(i, str(category)) for i, category in enumerate(axis["categories"])])
+
+    low, high = sorted(axis["range"])
+    length = (area["x1"] - area["x0"]) if axis["letter"] == "x" else (area["y1"] - area["y0"])
+    dtick = float(settings.get("dtick") or nice_step((high - low)/max(length/(80 if axis["letter"] == "x" else 40), 2)))
+    tick0 = float(settings.get("tick0", 0))
+    value = tick0 + math.ceil((low - tick0)/dtick - 1e-9)*dtick
+    ticks = []
+    while value <= high + dtick*1e-9:
+        value = round(value, 10)
+        ticks.append((value, f"{settings.get('tickprefix', '')}{value:g}{settings.get('ticksuffix', '')}"))
+        value += dtick
+    return(ticks)
+#endregion ------------------------------------------------------------------- #
+#region nice_step FUNCTION --------------------------------------------------- #
+def nice_step(raw: float) -> float:
+    '''
+    Rounds a tick step up to 1, 2, or 5 times a power of ten.
+    '''
+    if raw <= 0:
+        return(1.0)
+    power = 10**math.floor(math.log10(raw))
+    for multiple in (1, 2, 5, 10):
+        if raw <= multiple*power:
+            return(multiple*power)
+#endregion ------------------------------------------------------------------- #
+#region axis_line FUNCTION --------------------------------------------------- #
+def axis_line(axis: dict, area: dict, value: float, color: str, line_width: float) -> str:
+    '''
+    Draws a line across the plot area at a value of an axis (a gridline or
+    zero line).
+    '''
+    if axis["letter"] == "x":
+        x = to_pixels(axis, area, value)
+        return(svg_line(x, area["y0"], x, area["y1"], color, line_width))
+    y = to_pixels(axis, area, value)
+    return(svg_line(area["x0"], y, area["x1"], y, color, line_width))
+#endregion ------------------------------------------------------------------- #
+#region draw_bars FUNCTION --------------------------------------------------- #
+def draw_bars(trace: dict, layout: dict, area: dict, axes: dict,
+              font: dict) -> tuple[list[str], list[str]]:
+    '''
+    Draws the bars of a bar trace, from zero to each value across
+    `1 - bargap` of their category, and their `texttemplate` labels: inside the
+    end of the bar if they fit, otherwise just past it. Returns the bars and
+    the labels, which go above every trace.
+    '''
+    category_letter, value_letter = bar_axes(trace)
+    category_axis, value_axis = axes[category_letter], axes[value_letter]
+    marker = trace.get("marker", {})
+    color = trace_color(trace)
+    outline = marker.get("line", {})
+    half = (1 - layout.get("bargap", 0.2))/2
+
+    bars, labels = [], []
+    for category, value in zip(trace.get(category_letter, []), trace.get(value_letter, [])):
+        position = category_axis["categories"].index(category) if category_axis["type"] == "category" else float(category)
+        value = float(value)
+        band = sorted([
+            to_pixels(category_axis, area, position - half),
+            to_pixels(category_axis, area, position + half),
+        ])
+        length = sorted([to_pixels(value_axis, area, 0), to_pixels(value_axis, area, value)])
+        if value_letter == "x":
+            x, y, w, h = length[0], band[0], length[1] - length[0], band[1] - band[0]
+        else:
+            x, y, w, h = band[0], length[0], band[1] - band[0], length[1] - length[0]
+        bars.append(
+            f'<rect x="{num(x)}" y="{num(y)}" width="{num(w)}" height="{num(h)}" fill="{color}" '
+            f'stroke="{outline.get("color", "none")}" stroke-width="{outline.get("width", 0)}"/>'
+        )
+
+        # Label the bar at its end, inside if the label fits.
+        if "texttemplate" not in trace and "text" not in trace:
+            continue
+        text = format_template(
+            trace.get("texttemplate", "%{text}"),
+            {"x": value if value_letter == "x" else category,
+             "y": value if value_letter == "y" else category,
+             "text": trace.get("text", [""])[0] if trace.get("text") else ""},
+        )
+        size = font["size"]
+        space = w if value_letter == "x" else h
+        fits = text_width(text, size) + 6 <= space
+        end = to_pixels(value_axis, area, value)
+        outward = 1 if (value >= 0) == (value_letter == "x") else -1
+        if value_letter == "x":
+            offset = -outward*3 if fits else outward*3
+            anchor = ("end" if outward > 0 else "start") if fits else ("start" if outward > 0 else "end")
+            labels.append(svg_text(
+                end + offset, y + h/2, text, size,
+                contrast_color(color) if fits else font["color"], anchor, "middle",
+            ))
+        else:
+            labels.append(svg_text(
+                x + w/2, end + (outward*3 if fits else -outward*3), text, size,
+                contrast_color(color) if fits else font["color"], "middle",
+                ("top" if outward > 0 else "bottom") if fits else ("bottom" if outward > 0 else "top"),
+            ))
+    return(bars, labels)
+#endregion ------------------------------------------------------------------- #
+#region bar_axes FUNCTION ---------------------------------------------------- #
+def bar_axes(trace: dict) -> tuple[str, str]:
+    '''
+    Gets the category axis and the value axis of a bar trace: ("y", "x") for
+    horizontal bars, ("x", "y") for vertical ones.
+    '''
+    return(("y", "x") if trace.get("orientation") == "h" else ("x", "y"))
+#endregion ------------------------------------------------------------------- #
+#region draw_lines FUNCTION -------------------------------------------------- #
+def draw_lines(trace: dict, area: dict, axes: dict) -> list[str]:
+    '''
+    Draws a line trace as a polyline in its color and dash style.
+    '''
+    points = []
+    for x, y in zip(trace.get("x", []), trace.get("y", [])):
+        if y is None or (isinstance(y, float) and math.isnan(y)):
+            continue
+        x = axes["x"]["categories"].index(x) if axes["x"]["type"] == "category" else float(x)
+        y = axes["y"]["categories"].index(y) if axes["y"]["type"] == "category" else float(y)
+        points.append(f"{num(to_pixels(axes['x'], area, x))},{num(to_pixels(axes['y'], area, y))}")
+    line = trace.get("line", {})
+    line_width = line.get("width", 2)
+    return([
+        f'<polyline points="{" ".join(points)}" fill="none" stroke="{trace_color(trace)}" '
+        f'stroke-width="{line_width}"{dash_attribute(line.get("dash", "solid"), line_width)}/>'
+    ])
+#endregion ------------------------------------------------------------------- #
+#region draw_axis FUNCTION --------------------------------------------------- #
+def draw_axis(axis: dict, area: dict, font: dict) -> list[str]:
+    '''
+    Draws an axis line on its side of the plot area (and the opposite side if
+    the axis is mirrored) and its tick labels.
+    '''
+    settings = axis["settings"]
+    tickfont = {**font, **settings.get("tickfont", {})}
+    elements = []
+    if axis["letter"] == "x":
+        sides = {"bottom": area["y1"], "top": area["y0"]}
+        side = settings.get("side", "bottom")
+    else:
+        sides = {"left": area["x0"], "right": area["x1"]}
+        side = settings.get("side", "left")
+
+    if settings.get("showline", False):
+        for name, position in sides.items():
+            if name == side or settings.get("mirror", False):
+                if axis["letter"] == "x":
+                    line = (area["x0"], position, area["x1"], position)
+                else:
+                    line = (position, area["y0"], position, area["y1"])
+                elements.append(svg_line(
+                    *line, settings.get("linecolor", "#444"), settings.get("linewidth", 1)
+                ))
+
+    if settings.get("showticklabels", True):
+        for value, label in axis["ticks"]:
+            pixel = to_pixels(axis, area, value)
+            if axis["letter"] == "x":
+                y = sides[side] + (6 if side == "bottom" else -6)
+                elements.append(svg_text(
+                    pixel, y, label, tickfont["size"], tickfont["color"],
+                    "middle", "top" if side == "bottom" else "bottom",
+                ))
+            else:
+                x = sides[side] + (-6 if side == "left" else 6)
+                elements.append(svg_text(
+                    x, pixel, label, tickfont["size"], tickfont["color"],
+                    "end" if side == "left" else "start", "middle",
+                ))
+    return(elements)
+#endregion ------------------------------------------------------------------- #
+#region draw_shapes FUNCTION ------------------------------------------------- #
+def draw_shapes(layout: dict, area: dict, axes: dict) -> list[str]:
+    '''
+    Draws the line shapes of the layout (e.g. from `add_vline`/`add_hline`),
+    which can be placed by data values or by fractions of the plot area.
+    '''
+    elements = []
+    for shape in layout.get("shapes", []):
+        if shape.get("type") != "line":
+            continue
+        x0 = position_pixels(shape.get("xref", "x"), shape["x0"], area, axes, "x")
+        x1 = position_pixels(shape.get("xref", "x"), shape["x1"], area, axes, "x")
+        y0 = position_pixels(shape.get("yref", "y"), shape["y0"], area, axes, "y")
+        y1 = position_pixels(shape.get("yref", "y"), shape["y1"], area, axes, "y")
+        line = shape.get("line", {})
+        opacity = shape.get("opacity", 1)
+        elements.append(svg_line(
+            x0, y0, x1, y1, line.get("color", "#444"), line.get("width", 2),
+            line.get("dash", "solid"), opacity,
+        ))
+    return(elements)
+#endregion ------------------------------------------------------------------- #
+#region draw_annotations FUNCTION -------------------------------------------- #
+def draw_annotations(layout: dict, area: dict, axes: dict, font: dict) -> list[str]:
+    '''
+    Draws the text annotations of the layout (without arrows). Annotations
+    placed by fractions of the plot area anchor on the side they are nearest,
+    as in plotly; those placed by data values anchor on their center.
+    '''
+    elements = []
+    for annotation in layout.get("annotations", []):
+        xref, yref = annotation.get("xref", "x"), annotation.get("yref", "y")
+        x, y = annotation.get("x", 0.5), annotation.get("y", 0.5)
+        xanchor = annotation.get("xanchor", "auto")
+        if xanchor == "auto":
+            xanchor = auto_anchor(x, ("left", "center", "right")) if xref == "paper" else "center"
+        yanchor = annotation.get("yanchor", "auto")
+        if yanchor == "auto":
+            yanchor = auto_anchor(y, ("bottom", "middle", "top")) if yref == "paper" else "middle"
+        annotation_font = {**font, **annotation.get("font", {})}
+        elements.append(svg_text(
+            position_pixels(xref, x, area, axes, "x"),
+            position_pixels(yref, y, area, axes, "y"),
+            plain_text(annotation.get("text", "")).strip(),
+            annotation_font["size"], annotation_font["color"],
+            {"left": "start", "center": "middle", "right": "end"}[xanchor], yanchor,
+        ))
+    return(elements)
+#endregion ------------------------------------------------------------------- #
+#region draw_legend FUNCTION ------------------------------------------------- #
+def draw_legend(legend: dict, area: dict, font: dict) -> list[str]:
+    '''
+    Draws the legend at its place relative to the plot area: a square swatch
+    for each pie slice or bar trace, a line sample for each line trace.
+    '''
+    if legend is None:
+        return([])
+    settings = legend["settings"]
+    x, y = settings.get("x", 1.02), settings.get("y", 1)
+    xanchor = settings.get("xanchor", "left")
+    if xanchor == "auto":
+        xanchor = auto_anchor(x, ("left", "center", "right"))
+    yanchor = settings.get("yanchor", "auto")
+    if yanchor == "auto":
+        yanchor = auto_anchor(y, ("bottom", "middle", "top"))
+    left = area["x0"] + x*(area["x1"] - area["x0"])
+    left -= {"left": 0, "center": legend["width"]/2, "right": legend["width"]}[xanchor]
+    top = area["y1"] - y*(area["y1"] - area["y0"])
+    top -= {"top": 0, "middle": legend["height"]/2, "bottom": legend["height"]}[yanchor]
+
+    elements = []
+    row = top + 3 + LEGEND_ROW/2
+    if legend["title"]:
+        elements.append(svg_text(left + 2, row, legend["title"], font["size"], font["color"], "start", "middle"))
+        row += LEGEND_ROW
+    for entry in legend["entries"]:
+        if entry["type"] == "scatter":
+            elements.append(svg_line(left + 5, row, left + 35, row, entry["color"], 2, entry["dash"]))
+        else:
+            elements.append(
+                f'<rect x="{num(left + 14)}" y="{num(row - 6)}" width="12" height="12" fill="{entry["color"]}"/>'
+            )
+        elements.append(svg_text(left + 40, row, entry["name"], font["size"], font["color"], "start", "middle"))
+        row += LEGEND_ROW
+    return(elements)
+#endregion ------------------------------------------------------------------- #
+#region draw_title FUNCTION -------------------------------------------------- #
+def draw_title(layout: dict, width: int, height: int, font: dict) -> list[str]:
+    '''
+    Draws the title, placed by fractions of the whole figure, one line per
+    `<br>`; lines in `<sup>` are drawn smaller.
+    '''
+    title = layout.get("title", {})
+    if not title.get("text"):
+        return([])
+    title_font = {**font, "size": font["size"]*1.4, **title.get("font", {})}
+    x, y = title.get("x", 0.5), title.get("y", 0.98)
+    xanchor = title.get("xanchor", "auto")
+    if xanchor == "auto":
+        xanchor = auto_anchor(x, ("left", "center", "right"))
+    anchor = {"left": "start", "center": "middle", "right": "end"}[xanchor]
+
+    elements = []
+    top = (1 - y)*height
+    for line in title["text"].split("<br>"):
+        size = title_font["size"]*(0.7 if "<sup>" in line else 1)
+        elements.append(svg_text(x*width, top, plain_text(line), size, title_font["color"], anchor, "top"))
+        top += size*1.3
+    return(elements)
+#endregion ------------------------------------------------------------------- #
+#region to_pixels FUNCTION --------------------------------------------------- #
+def to_pixels(axis: dict, area: dict, value: float) -> float:
+    '''
+    Converts a value on an axis (a category's position, for a category axis)
+    to pixels.
+    '''
+    low, high = axis["range"]
+    fraction = (value - low)/(high - low)
+    if axis["letter"] == "x":
+        return(area["x0"] + fraction*(area["x1"] - area["x0"]))
+    return(area["y1"] - fraction*(area["y1"] - area["y0"]))
+#endregion ------------------------------------------------------------------- #
+#region position_pixels FUNCTION --------------------------------------------- #
+def position_pixels(ref: str, value, area: dict, axes: dict, letter: str) -> float:
+    '''
+    Converts the position of a shape or annotation to pixels: by data value if
+    it refers to an axis ("x"), or by fraction of the plot area if it refers to
+    "paper" or an axis domain ("x domain").
+    '''
+    if ref == "paper" or ref.endswith("domain") or letter not in axes:
+        if letter == "x":
+            return(area["x0"] + float(value)*(area["x1"] - area["x0"]))
+        return(area["y1"] - float(value)*(area["y1"] - area["y0"]))
+    axis = axes[letter]
+    if axis["type"] == "category":
+        value = axis["categories"].index(value)
+    return(to_pixels(axis, area, float(value)))
+#endregion ------------------------------------------------------------------- #
+#region svg_text FUNCTION ---------------------------------------------------- #
+def svg_text(x: float, y: float, text: str, size: float, color: str,
+             anchor: str = "start", baseline: str = "middle") -> str:
+    '''
+    Gets an SVG text element, with `y` at its "top", "middle" or "bottom".
+    Baselines are worked out here rather than with `dominant-baseline`, which
+    not every SVG viewer supports.
+    '''
+    y += {"top": 0.8, "middle": 0.35, "bottom": -0.2}[baseline]*size
+    return(
+        f'<text x="{num(x)}" y="{num(y)}" font-size="{num(size)}" fill="{color}" '
+        f'text-anchor="{anchor}">{escape(text)}</text>'
+    )
+#endregion ------------------------------------------------------------------- #
+#region svg_line FUNCTION ---------------------------------------------------- #
+def svg_line(x0: float, y0: float, x1: float, y1: float, color: str,
+             line_width: float, dash: str = "solid", opacity: float = 1) -> str:
+    '''
+    Gets an SVG line element in a dash style (see `DASH_PATTERNS`).
+    '''
+    return(
+        f'<line x1="{num(x0)}" y1="{num(y0)}" x2="{num(x1)}" y2="{num(y1)}" '
+        f'stroke="{color}" stroke-width="{line_width}"{dash_attribute(dash, line_width)}'
+        + (f' opacity="{opacity}"' if opacity != 1 else "") + "/>"
+    )
+#endregion ------------------------------------------------------------------- #
+#region dash_attribute FUNCTION ---------------------------------------------- #
+def dash_attribute(dash: str, line_width: float) -> str:
+    '''
+    Gets the `stroke-dasharray` attribute of a dash style, or nothing for solid
+    lines. Dash styles plotly names scale with the line width; others are
+    taken as a dash length list (e.g. "5px,10px").
+    '''
+    if dash in DASH_PATTERNS:
+        pattern = [length*max(line_width, 3) for length in DASH_PATTERNS[dash]]
+    else:
+        pattern = [float(length.strip().removesuffix("px")) for length in dash.split(",")]
+    if not pattern:
+        return("")
+    return(f' stroke-dasharray="{",".join(num(length) for length in pattern)}"')
+#endregion ------------------------------------------------------------------- #
+#region trace_color FUNCTION ------------------------------------------------- #
+def trace_color(trace: dict) -> str:
+    '''
+    Gets the color of a bar or line trace.
+    '''
+    if trace.get("type") == "bar":
+        return(trace.get("marker", {}).get("color", "#636efa"))
+    return(trace.get("line", {}).get("color") or trace.get("marker", {}).get("color", "#636efa"))
+#endregion ------------------------------------------------------------------- #
+#region contrast_color FUNCTION ---------------------------------------------- #
+def contrast_color(color: str) -> str:
+    '''
+    Gets the text color (black or white) that reads best on a "#RRGGBB" or
+    "#RGB" color. Other colors get white text.
+    '''
+    if not re.fullmatch(r"#([0-9a-fA-F]{3}){1,2}", color):
+        return("white")
+    digits = color[1:] if len(color) == 7 else "".join(digit*2 for digit in color[1:])
+    red, green, blue = (int(digits[i:i + 2], 16)/255 for i in (0, 2, 4))
+    return("black" if 0.299*red + 0.587*green + 0.114*blue > 0.5 else "white")
+#endregion ------------------------------------------------------------------- #
+#region format_template FUNCTION --------------------------------------------- #
+def format_template(template: str, values: dict) -> str:
+    '''
+    Fills in a plotly text template (e.g. "%{percent:.1%}"). The d3 format
+    specifiers the charts use are also Python format specifiers.
+    '''
+    def replace(match: re.Match) -> str:
+        value = values.get(match.group(1), "")
+        if match.group(2):
+            return(format(float(value), match.group(2)))
+        return(f"{value:g}" if isinstance(value, float) else str(value))
+    return(plain_text(re.sub(r"%\{(\w+)(?::([^}]*))?\}", replace, template)))
+#endregion ------------------------------------------------------------------- #
+#region auto_anchor FUNCTION ------------------------------------------------- #
+def auto_anchor(fraction: float, anchors: tuple) -> str:
+    '''
+    Gets the anchor plotly picks for a position given as a fraction: the low
+    side below 1/3, the high side above 2/3, and the middle otherwise.
+    '''
+    if fraction <= 1/3:
+        return(anchors[0])
+    if fraction >= 2/3:
+        return(anchors[2])
+    return(anchors[1])
+#endregion ------------------------------------------------------------------- #
+#region plain_text FUNCTION -------------------------------------------------- #
+def plain_text(text: str) -> str:
+    '''
+    Strips the HTML tags plotly allows in text (e.g. "<sup>").
+    '''
+    return(re.sub(r"<[^>]+>", "", text))
+#endregion ------------------------------------------------------------------- #
+#region text_width FUNCTION -------------------------------------------------- #
+def text_width(text: str, size: float) -> float:
+    '''
+    Estimates the width of a text in pixels (see `CHAR_WIDTH`).
+    '''
+    return(len(text)*size*CHAR_WIDTH)
+#endregion ------------------------------------------------------------------- #
+#region is_number FUNCTION --------------------------------------------------- #
+def is_number(value) -> bool:
+    '''
+    Checks whether a value is a number or a string of one, as plotly does when
+    it picks an axis type.
+    '''
+    try:
+        float(value)
+        return(True)
+    except (TypeError, ValueError):
+        return(False)
+#endregion ------------------------------------------------------------------- #
+#region as_list FUNCTION ----------------------------------------------------- #
+def as_list(value):
+    '''
+    Converts a NumPy array (as in `go.Figure.to_plotly_json`) to a list; other
+    values are returned as they are.
+    '''
+    return(value.tolist() if hasattr(value, "tolist") else value)
+#endregion ------------------------------------------------------------------- #
+#region num FUNCTION --------------------------------------------------------- #
+def num(value: float) -> str:
+    '''
+    Formats a pixel coordinate with one decimal.
+    '''
+    return(f"{value:.1f}")
+#endregion ------------------------------------------------------------------- #
+################################################################################
+#endregion
+################################################################################
@@ -0,0 +1,37 @@
+################################################################################
+#region IMPORTS
+################################################################################
+from contextlib import contextmanager
+from typing import Iterator
+import time
+################################################################################
+#endregion
+################################################################################
+
+
+
+################################################################################
+#region FUNCTIONS
+################################################################################
+#region stage_timer FUNCTION ------------------------------------------------- #
+@contextmanager
+def stage_timer(stage: str, timings: dict) -> Iterator[None]:
+    '''
+    Records the wall time of a pipeline stage in `timings`.
+    '''
+    start = time.perf_counter()
+    yield
+    timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+#endregion ------------------------------------------------------------------- #
+#region print_timings FUNCTION ----------------------------------------------- #
+def print_timings(timings: dict) -> None:
+    '''
+    Prints the wall time of each pipeline stage and the total.
+    '''
+    for stage, seconds in timings.items():
+        print(f"{stage:<24}{seconds:8.3f} s")
+    print(f"{'total':<24}{sum(timings.values()):8.3f} s")
+#endregion ------------------------------------------------------------------- #
+################################################################################
+#endregion
+################################################################################